@@ -0,0 +1,80 @@
+import sys
+import time
+from ast import *
+
+sys.setrecursionlimit(1000000)
+
+from interp_Lcast import InterpLcast
+from utils import *
+
+# A gradual typing benchmark for InterpLcast: a list goes back and
+# forth between list[Any] and list[int] on every iteration of a loop,
+# and one element is read each time. With collapse_casts the list is
+# wrapped in a single proxy throughout. Without it each iteration adds
+# two proxies, which every later read has to go through. The first two
+# columns compare building the closures of each cast afresh with
+# sharing them per (source, mid, target) through cache_casts.
+# Usage: python3 bench_casts.py [iterations ...]
+
+any_list = ListType(AnyType())
+int_list = ListType(IntType())
+
+def program(n: int) -> Module:
+  x = Name('x')
+  i = Name('i')
+  s = Name('s')
+  elements = List([Constant(k) for k in range(10)], Load())
+  round_trip = Cast(Cast(x, any_list, int_list), int_list, any_list)
+  read = Cast(Call(Name('array_load'), [x, Constant(3)]), AnyType(), IntType())
+  return Module([
+    Assign([x], Cast(elements, int_list, any_list)),
+    Assign([i], Constant(0)),
+    Assign([s], Constant(0)),
+    While(Compare(i, [Lt()], [Constant(n)]),
+          [Assign([x], round_trip),
+           Assign([s], BinOp(s, Add(), read)),
+           Assign([i], BinOp(i, Add(), Constant(1)))],
+          []),
+    Expr(Call(Name('print'), [s]))
+  ], [])
+
+class CountingInterpLcast(InterpLcast):
+  def interp_stmt(self, s, env, cont):
+    match s:
+      case Expr(Call(Name('print'), [arg])):
+        self.result = self.interp_exp(arg, env)
+        self.final = env['x']
+        return self.interp_stmts(cont, env)
+      case _:
+        return super().interp_stmt(s, env, cont)
+
+def proxy_depth(v) -> int:
+  depth = 0
+  while isinstance(v, ProxiedList):
+    v = v.tup
+    depth += 1
+  return depth
+
+def run(collapse: bool, cache: bool, n: int):
+  interp = CountingInterpLcast()
+  interp.collapse_casts = collapse
+  interp.cache_casts = cache
+  interp.cast_closure_table.clear()
+  start = time.perf_counter()
+  interp.interp(program(n))
+  elapsed = time.perf_counter() - start
+  return (interp.result, elapsed, proxy_depth(interp.final))
+
+def main(sizes):
+  print(f'{"iterations":>10} {"uncached s":>11} {"collapsed s":>12}'
+        f' {"depth":>6} {"layered s":>12} {"depth":>6}')
+  for n in sizes:
+    (r0, t0, d0) = run(True, False, n)
+    (r1, t1, d1) = run(True, True, n)
+    (r2, t2, d2) = run(False, True, n)
+    if r0 != r1 or r1 != r2 or r1 != 3 * n:
+      raise Exception('different results: ' + repr(r1) + ' ' + repr(r2))
+    print(f'{n:>10} {t0:>11.4f} {t1:>12.4f} {d1:>6} {t2:>12.4f} {d2:>6}')
+
+if __name__ == '__main__':
+  main([int(a) for a in sys.argv[1:]] or [50, 100, 200, 400])
@@ -0,0 +1,129 @@
+import ctypes
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Measures garbage collection pauses of the runtime, with the copying
+# collector and with GC_GENERATIONAL=1. The runtime is built as a
+# shared library and driven through ctypes by a mutator that plays the
+# part of a compiled program: it allocates by bumping free_ptr, keeps
+# its live pointers on the root stack, and calls collect when the
+# nursery is full. It builds a long linked list that stays live, makes
+# some garbage tuples per list cell, and keeps the last few numbers in
+# boxes that only an old table tuple points to, storing into the table
+# through write_barrier. Both the list and the table are checked.
+# Usage: python3 bench_gc.py [cells] [heap bytes]
+
+class Mutator:
+
+  def __init__(self, lib, heap_bytes: int, num_roots: int):
+    self.lib = lib
+    # every store below goes through set_field, and so the barrier
+    ctypes.c_int64.in_dll(lib, 'uses_write_barrier').value = 1
+    lib.initialize(ctypes.c_uint64(8 * num_roots), ctypes.c_uint64(heap_bytes))
+    self.free_ptr = ctypes.c_uint64.in_dll(lib, 'free_ptr')
+    self.fromspace_end = ctypes.c_uint64.in_dll(lib, 'fromspace_end')
+    self.rootstack = ctypes.c_uint64.in_dll(lib, 'rootstack_begin').value
+    self.roots = (ctypes.c_int64 * num_roots).from_address(self.rootstack)
+    for i in range(num_roots):
+      self.roots[i] = 0
+    self.rootstack_ptr = ctypes.c_void_p(self.rootstack + 8 * num_roots)
+    self.pauses = []
+
+  # Allocates a tuple of n fields; ptr_mask says which are pointers.
+  def allocate(self, n: int, ptr_mask: int) -> int:
+    size = 8 * (n + 1)
+    if self.free_ptr.value + size > self.fromspace_end.value:
+      start = time.perf_counter()
+      self.lib.collect(self.rootstack_ptr, ctypes.c_uint64(size))
+      self.pauses.append(time.perf_counter() - start)
+    address = self.free_ptr.value
+    self.free_ptr.value = address + size
+    self.store(address, (ptr_mask << 7) | (n << 1) | 1)
+    for i in range(n):
+      self.store(address + 8 * (i + 1), 0)
+    return address
+
+  def load(self, address: int) -> int:
+    return ctypes.c_int64.from_address(address).value
+
+  def store(self, address: int, value: int):
+    ctypes.c_int64.from_address(address).value = value
+
+  def set_field(self, tup: int, i: int, value: int):
+    field = tup + 8 * (i + 1)
+    self.store(field, value)
+    self.lib.write_barrier(ctypes.c_void_p(field), ctypes.c_int64(value))
+
+def run(lib, cells: int, heap_bytes: int, garbage: int = 4, table: int = 8,
+        stride: int = 64):
+  m = Mutator(lib, heap_bytes, 2)
+  # roots[0] is the list, roots[1] the table of boxes
+  m.roots[1] = m.allocate(table, (1 << table) - 1)
+  for k in range(cells):
+    for g in range(garbage):
+      m.allocate(2, 0)
+    cell = m.allocate(2, 0b10)
+    m.set_field(cell, 0, k)
+    m.set_field(cell, 1, m.roots[0])
+    m.roots[0] = cell
+    # every stride cells, box k and put it in the next slot of the
+    # table, where it stays for table * stride cells
+    n = k // stride
+    if k % stride == 0:
+      box = m.allocate(1, 0)
+      m.set_field(box, 0, k)
+      m.set_field(m.roots[1], n % table, box)
+    for i in range(min(table, n + 1)):
+      box = m.load(m.roots[1] + 8 * (i + 1))
+      if m.load(box + 8) != (n - (n - i) % table) * stride:
+        raise Exception('wrong box in the table at ' + str(k))
+  total = 0
+  cell = m.roots[0]
+  while cell:
+    total += m.load(cell + 8)
+    cell = m.load(cell + 16)
+  if total != cells * (cells - 1) // 2:
+    raise Exception('wrong sum of the list: ' + str(total))
+  return m.pauses
+
+def build_library(directory: str) -> str:
+  library = os.path.join(directory, 'libruntime.so')
+  subprocess.run(['gcc', '-O2', '-DNDEBUG', '-shared', '-fPIC',
+                  'runtime.c', '-o', library], check=True)
+  return library
+
+def load(library: str, name: str, generational: bool):
+  # each mode gets its own copy of the library, and so of its globals
+  copy = os.path.join(os.path.dirname(library), name + '.so')
+  shutil.copy(library, copy)
+  lib = ctypes.CDLL(copy)
+  lib.collect.argtypes = [ctypes.c_void_p, ctypes.c_uint64]
+  lib.write_barrier.argtypes = [ctypes.c_void_p, ctypes.c_int64]
+  if generational:
+    os.environ['GC_GENERATIONAL'] = '1'
+  else:
+    os.environ.pop('GC_GENERATIONAL', None)
+  return lib
+
+def main(cells: int, heap_bytes: int):
+  with tempfile.TemporaryDirectory() as directory:
+    library = build_library(directory)
+    print(f'{"collector":<13} {"collections":>11} {"total ms":>9}'
+          f' {"mean ms":>8} {"max ms":>8}')
+    for (name, generational) in [('copying', False),
+                                 ('generational', True)]:
+      lib = load(library, name, generational)
+      pauses = run(lib, cells, heap_bytes)
+      total = 1000 * sum(pauses)
+      mean = total / len(pauses) if pauses else 0.0
+      longest = 1000 * max(pauses, default=0.0)
+      print(f'{name:<13} {len(pauses):>11} {total:>9.2f} {mean:>8.3f}'
+            f' {longest:>8.3f}')
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000,
+       int(sys.argv[2]) if len(sys.argv) > 2 else 16384)
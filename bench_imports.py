@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+
+# Startup benchmark: imports each module in a fresh interpreter with
+# python -X importtime and summarizes the report, giving the
+# cumulative import time of the module and of the heavy dependencies
+# (lark and pandas) it pulled in, if any. Test workers import these
+# modules on startup, so anything listed under "pulls in" is paid by
+# every worker, whether or not it emulates x86.
+# Usage: python3 bench_imports.py [module ...]
+
+heavy = ['lark', 'pandas']
+
+def import_times(module: str) -> dict:
+    root = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([root,
+                                         os.path.join(root, 'interp_x86')])
+    result = subprocess.run([sys.executable, '-X', 'importtime',
+                             '-c', 'import ' + module],
+                            cwd=root, env=env, capture_output=True,
+                            text=True, check=True)
+    # lines look like "import time:   self [us] | cumulative | package",
+    # with the package indented by its depth in the import tree
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].strip()
+        times.setdefault(name, int(fields[1]) / 1000)
+    return times
+
+def main(modules):
+    print(f'{"module":<28} {"ms":>8}  pulls in')
+    for module in modules:
+        times = import_times(module)
+        pulled = ', '.join(f'{h} ({times[h]:.1f} ms)' for h in heavy
+                           if h in times)
+        print(f'{module:<28} {times.get(module, 0.0):>8.1f}'
+              f'  {pulled or "-"}')
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or ['utils', 'eval_x86', 'interp_x86.eval_x86',
+                          'compiler', 'compiler_register_allocator',
+                          'parser_x86'])
@@ -0,0 +1,103 @@
+import io
+import os
+import sys
+import time
+from ast import parse
+
+sys.setrecursionlimit(100000)
+
+from interp_Lfun import InterpLfun
+from interp_Lfun_closures import ClosureInterpLfun
+
+# Compares InterpLfun with the closure-compiling ClosureInterpLfun on
+# the test programs and on a few larger ones, checking that both
+# print the same output.
+# Usage: python3 bench_interp.py [repetitions]
+
+programs = {
+  'loop': '''
+i = 0
+s = 0
+while i < 20000:
+    if i < 10000:
+        s = s + i * 2
+    else:
+        s = s - 1
+    i = i + 1
+print(s)
+''',
+  'fib': '''
+def fib(n: int) -> int:
+    if n < 2:
+        return n
+    else:
+        return fib(n - 1) + fib(n - 2)
+print(fib(17))
+''',
+  'array': '''
+def sum(a: list[int], n: int) -> int:
+    s = 0
+    i = 0
+    while i < n:
+        s = s + a[i]
+        i = i + 1
+    return s
+a = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+i = 0
+t = 0
+while i < 1000:
+    a[3] = i
+    t = t + sum(a, len(a))
+    i = i + 1
+print(t)
+''',
+}
+
+def run(interp, source: str, input: str):
+  stdin = sys.stdin
+  stdout = sys.stdout
+  sys.stdin = io.StringIO(input)
+  sys.stdout = io.StringIO()
+  try:
+    start = time.perf_counter()
+    interp.interp(parse(source))
+    elapsed = time.perf_counter() - start
+    return (sys.stdout.getvalue(), elapsed)
+  finally:
+    sys.stdin = stdin
+    sys.stdout = stdout
+
+def test_programs():
+  for lang in sorted(os.listdir('tests')):
+    directory = os.path.join('tests', lang)
+    for name in sorted(os.listdir(directory)):
+      if name.endswith('.py'):
+        root = os.path.join(directory, name[:-3])
+        with open(root + '.py') as f:
+          source = f.read()
+        input = ''
+        if os.path.exists(root + '.in'):
+          with open(root + '.in') as f:
+            input = f.read()
+        yield (lang + '/' + name[:-3], source, input)
+
+def main(repetitions: int):
+  print(f'{"program":<16} {"InterpLfun s":>12} {"closures s":>12}'
+        f' {"speedup":>8}')
+  for (name, source, input) in list(test_programs()) \
+      + [(name, source, '') for (name, source) in programs.items()]:
+    tree_time = 0.0
+    closure_time = 0.0
+    for _ in range(repetitions):
+      (expected, elapsed) = run(InterpLfun(), source, input)
+      tree_time += elapsed
+      (output, elapsed) = run(ClosureInterpLfun(), source, input)
+      closure_time += elapsed
+      if output != expected:
+        raise Exception('different output on ' + name + ': '
+                        + repr(output) + ' != ' + repr(expected))
+    print(f'{name:<16} {tree_time:>12.4f} {closure_time:>12.4f}'
+          f' {tree_time / closure_time:>7.1f}x')
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 1)
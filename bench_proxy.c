@@ -0,0 +1,184 @@
+// Microbenchmark for reading and writing through chains of proxies
+// with the runtime's proxy_vec_ref and proxy_vec_set, for tuples and
+// vectorofs. It also times a recursive reader, the way the runtime
+// used to walk the chain, for chains short enough for the C stack, and
+// reading through a proxy made by the same casts with collapse_proxy,
+// which builds the chain on the GC heap one proxy deep.
+//
+// The closures are static, outside the heap, which the collector's
+// debugging checks do not allow, so build it with NDEBUG:
+//
+//   gcc -O2 -DNDEBUG bench_proxy.c runtime.c -o bench_proxy && ./bench_proxy
+
+#include <inttypes.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+
+// runtime.h defines the heap variables, so only declare what we use.
+int64_t proxy_vec_ref(int64_t* vec, int i);
+int64_t proxy_vec_set(int64_t* vec, int i, int64_t arg);
+int64_t apply_closure(int64_t* clos, int64_t arg);
+int is_vector_proxy(int64_t* vec);
+void initialize(uint64_t rootstack_size, uint64_t heap_size);
+void collect(int64_t** rootstack_ptr, uint64_t bytes_requested);
+int64_t* collapse_proxy(int64_t* proxy, int64_t** rootstack_ptr);
+extern int64_t* free_ptr;
+extern int64_t* fromspace_end;
+extern int64_t** rootstack_begin;
+
+static const int64_t PROXY_BIT = (int64_t)1 << 63;
+static const int64_t VECOF_BIT = (int64_t)1 << 62;
+
+static int64_t increment(int64_t* clos, int64_t x) { return x + 1; }
+static int64_t decrement(int64_t* clos, int64_t x) { return x - 1; }
+
+static int64_t read_closure[2] = { 3, (int64_t) increment };
+static int64_t write_closure[2] = { 3, (int64_t) decrement };
+static int64_t read_tuple[3] = { (3 << 7) | (2 << 1) | 1,
+                                 (int64_t) read_closure,
+                                 (int64_t) read_closure };
+static int64_t write_tuple[3] = { (3 << 7) | (2 << 1) | 1,
+                                  (int64_t) write_closure,
+                                  (int64_t) write_closure };
+
+static int64_t* make(int n) {
+  int64_t* v = malloc(n * sizeof(int64_t));
+  if (!v) {
+    printf("out of memory\n");
+    exit(EXIT_FAILURE);
+  }
+  return v;
+}
+
+// Wraps a two element tuple, or a vectorof of length two, in depth
+// proxies.
+static int64_t* make_chain(int depth, int vecof) {
+  int64_t* vec = make(3);
+  vec[0] = vecof ? (VECOF_BIT | (2 << 2) | 1) : ((2 << 1) | 1);
+  vec[1] = 0;
+  vec[2] = 0;
+  int64_t* reads = make(3);
+  int64_t* writes = make(3);
+  reads[0] = writes[0] = (2 << 1) | 1;
+  reads[1] = reads[2] = (int64_t) read_closure;
+  writes[1] = writes[2] = (int64_t) write_closure;
+  for (int d = 0; d != depth; ++d) {
+    int64_t* proxy = make(4);
+    proxy[0] = PROXY_BIT | (vecof ? VECOF_BIT : 0) | 1;
+    proxy[1] = (int64_t) vec;
+    proxy[2] = vecof ? (int64_t) read_closure : (int64_t) reads;
+    proxy[3] = vecof ? (int64_t) write_closure : (int64_t) writes;
+    vec = proxy;
+  }
+  return vec;
+}
+
+// Allocates on the GC heap; the chain being built is the first root.
+static int64_t* allocate(int words) {
+  if (free_ptr + words > fromspace_end)
+    collect(rootstack_begin + 1, words * sizeof(int64_t));
+  int64_t* v = free_ptr;
+  free_ptr += words;
+  return v;
+}
+
+static int64_t* make_collapsed_chain(int depth, int vecof) {
+  int64_t* vec = allocate(3);
+  vec[0] = vecof ? (VECOF_BIT | (2 << 2) | 1) : ((2 << 1) | 1);
+  vec[1] = 0;
+  vec[2] = 0;
+  rootstack_begin[0] = vec;
+  for (int d = 0; d != depth; ++d) {
+    int64_t* proxy = allocate(4);
+    proxy[0] = vecof ? (PROXY_BIT | VECOF_BIT | (3 << 2) | (1 << 1) | 1)
+                     : (PROXY_BIT | (7 << 7) | (3 << 1) | 1);
+    proxy[1] = (int64_t) rootstack_begin[0];
+    proxy[2] = vecof ? (int64_t) read_closure : (int64_t) read_tuple;
+    proxy[3] = vecof ? (int64_t) write_closure : (int64_t) write_tuple;
+    rootstack_begin[0] = collapse_proxy(proxy, rootstack_begin + 1);
+  }
+  return rootstack_begin[0];
+}
+
+static int proxy_depth(int64_t* vec) {
+  int depth = 0;
+  for (; is_vector_proxy(vec); vec = (int64_t*) vec[1])
+    ++depth;
+  return depth;
+}
+
+static int64_t recursive_ref(int64_t* vec, int i) {
+  if (is_vector_proxy(vec)) {
+    int64_t val = recursive_ref((int64_t*) vec[1], i);
+    int64_t* rd = (int64_t*) ((int64_t*) vec[2])[i+1];
+    return apply_closure(rd, val);
+  } else {
+    return vec[i+1];
+  }
+}
+
+static double seconds() {
+  struct timespec t;
+  clock_gettime(CLOCK_MONOTONIC, &t);
+  return t.tv_sec + t.tv_nsec * 1e-9;
+}
+
+int main() {
+  int depths[] = { 0, 1, 10, 100, 1000, 10000, 100000, 1000000 };
+  int recursive_limit = 10000;
+  // collapsing copies the composite closures, so building a chain of
+  // n casts takes time quadratic in n
+  int collapsed_limit = 10000;
+  initialize(16 * sizeof(int64_t), 1 << 16);
+  printf("%8s %8s %12s %12s %12s %12s\n", "depth", "kind", "ref ns/layer",
+         "set ns/layer", "recursive", "collapsed");
+  for (int k = 0; k != sizeof(depths) / sizeof(depths[0]); ++k) {
+    int depth = depths[k];
+    long reps = 10000000 / (depth + 1);
+    for (int vecof = 0; vecof != 2; ++vecof) {
+      int64_t* vec = make_chain(depth, vecof);
+      int64_t sum = 0;
+      double start = seconds();
+      for (long r = 0; r != reps; ++r)
+        sum += proxy_vec_ref(vec, 1);
+      double ref = seconds() - start;
+      start = seconds();
+      for (long r = 0; r != reps; ++r)
+        proxy_vec_set(vec, 1, depth);
+      double set = seconds() - start;
+      if (sum != reps * (int64_t) depth || proxy_vec_ref(vec, 1) != depth) {
+        printf("wrong result at depth %d\n", depth);
+        return EXIT_FAILURE;
+      }
+      double per_layer = 1e9 / ((double) reps * (depth + 1));
+      char recursive[32] = "-";
+      if (!vecof && depth <= recursive_limit) {
+        start = seconds();
+        for (long r = 0; r != reps; ++r)
+          sum += recursive_ref(vec, 1);
+        snprintf(recursive, sizeof(recursive), "%.2f",
+                 (seconds() - start) * per_layer);
+      }
+      char collapsed[32] = "-";
+      if (depth <= collapsed_limit) {
+        vec = make_collapsed_chain(depth, vecof);
+        int64_t collapsed_sum = 0;
+        start = seconds();
+        for (long r = 0; r != reps; ++r)
+          collapsed_sum += proxy_vec_ref(vec, 1);
+        double elapsed = seconds() - start;
+        if (collapsed_sum != reps * (int64_t) depth
+            || proxy_depth(vec) != (depth > 0)) {
+          printf("wrong collapsed result at depth %d\n", depth);
+          return EXIT_FAILURE;
+        }
+        snprintf(collapsed, sizeof(collapsed), "%.2f", elapsed * per_layer);
+      }
+      printf("%8d %8s %12.2f %12.2f %12s %12s\n", depth,
+             vecof ? "vecof" : "tuple", ref * per_layer, set * per_layer,
+             recursive, collapsed);
+    }
+  }
+  return 0;
+}
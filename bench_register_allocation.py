@@ -0,0 +1,132 @@
+import sys
+import time
+import random
+from ast import parse
+
+sys.path.append('interp_x86')
+
+import compiler_register_allocator
+from x86_ast import *
+from utils import label_name
+from convert_x86 import convert_program
+from eval_x86 import X86Emulator
+
+# Compares graph coloring with linear scan on large generated Lvar
+# programs: time spent allocating registers and number of spilled
+# variables. Then compares spilling by cost with spilling every
+# variable alike on a loop, counting the memory operands that run.
+# Usage: python3 bench_register_allocation.py [sizes...]
+
+def generate_program(num_stmts: int, window: int, seed: int = 0) -> str:
+    rand = random.Random(seed)
+    lines = ['x0 = input_int()']
+    for n in range(1, num_stmts):
+        # each statement reads variables from the last `window`
+        # statements, which bounds how many are live at a time
+        a = 'x' + str(rand.randrange(max(0, n - window), n))
+        b = 'x' + str(rand.randrange(max(0, n - window), n))
+        match rand.randrange(4):
+            case 0:
+                lines.append(f'x{n} = {a} + {b}')
+            case 1:
+                lines.append(f'x{n} = {a} - {rand.randrange(100)}')
+            case 2:
+                lines.append(f'x{n} = - {a}')
+            case 3:
+                lines.append(f'x{n} = {a} + {b} - {rand.randrange(100)}')
+    lines.append(f'print(x{num_stmts - 1})')
+    return '\n'.join(lines) + '\n'
+
+def allocate(compiler, source: str, linear_scan: bool):
+    program = compiler.remove_complex_operands(parse(source))
+    program = compiler.select_instructions(program)
+    num_instrs = len(program.body)
+    start = time.perf_counter()
+    live_after = compiler.uncover_live(program)
+    if linear_scan:
+        (intervals, reg_points) = compiler.live_intervals(program, live_after)
+        (coloring, spilled) = compiler.linear_scan(intervals, reg_points)
+    else:
+        graph = compiler.build_interference(program, live_after)
+        variables = {v for v in graph.vertices() if isinstance(v, Variable)}
+        (coloring, spilled) = compiler.color_graph(graph, variables)
+    elapsed = time.perf_counter() - start
+    return (num_instrs, len(coloring), len(spilled), elapsed)
+
+# A loop that updates i, acc and step while twelve cold variables,
+# defined before the loop and used after it, stay live throughout.
+def loop_program(iterations: int, num_cold: int = 12) -> X86Program:
+    i, acc, step, t = (Variable(x) for x in ['i', 'acc', 'step', 't'])
+    cold = [Variable('c' + str(n)) for n in range(num_cold)]
+    start = [Instr('movq', [Immediate(0), i]),
+             Instr('movq', [Immediate(0), acc]),
+             Instr('movq', [Immediate(3), step])] \
+        + [Instr('movq', [Immediate(n), c]) for (n, c) in enumerate(cold)] \
+        + [Jump('loop')]
+    loop = [Instr('cmpq', [Immediate(iterations), i]),
+            JumpIf('l', 'body'),
+            Jump('done')]
+    body = [Instr('addq', [step, acc]),
+            Instr('addq', [Immediate(1), step]),
+            Instr('addq', [Immediate(1), i]),
+            Jump('loop')]
+    done = [Instr('movq', [acc, t])] \
+        + [Instr('addq', [c, t]) for c in cold] \
+        + [Instr('movq', [t, Reg('rdi')]),
+           Callq(label_name('print_int'), 1),
+           Instr('movq', [Immediate(0), Reg('rax')]),
+           Jump(label_name('conclusion'))]
+    return X86Program({label_name('start'): start, 'loop': loop,
+                       'body': body, 'done': done})
+
+class UniformCostCompiler(compiler_register_allocator.Compiler):
+    def spill_costs(self, p, live_after):
+        return None
+
+class MemoryCountingEmulator(X86Emulator):
+    def __init__(self):
+        super().__init__(logging=False)
+        self.memory_operands = 0
+
+    def eval_arg(self, a):
+        if a.data == 'mem_a':
+            self.memory_operands += 1
+        return super().eval_arg(a)
+
+    def store_arg(self, a, v):
+        if a.data == 'mem_a':
+            self.memory_operands += 1
+        super().store_arg(a, v)
+
+def run_loop(compiler, iterations: int):
+    program = compiler.assign_homes(loop_program(iterations))
+    program = compiler.patch_instructions(program)
+    program = compiler.prelude_and_conclusion(program)
+    emulator = MemoryCountingEmulator()
+    emulator.eval_program(convert_program(program))
+    return emulator.memory_operands
+
+def main(sizes):
+    compiler = compiler_register_allocator.Compiler()
+    print(f'{"stmts":>7} {"window":>6} {"instrs":>7} {"vars":>6}'
+          f' {"color s":>9} {"spills":>6} {"scan s":>9} {"spills":>6}')
+    for size in sizes:
+        for window in (4, 16):
+            source = generate_program(size, window)
+            (num_instrs, num_vars, color_spills, color_time) = \
+                allocate(compiler, source, False)
+            (_, _, scan_spills, scan_time) = \
+                allocate(compiler, source, True)
+            print(f'{size:>7} {window:>6} {num_instrs:>7} {num_vars:>6}'
+                  f' {color_time:>9.3f} {color_spills:>6}'
+                  f' {scan_time:>9.3f} {scan_spills:>6}')
+    # the emulator recurses on every jump
+    sys.setrecursionlimit(100000)
+    print()
+    print(f'{"iterations":>10} {"cost mem ops":>12} {"uniform mem ops":>15}')
+    for iterations in (10, 100, 1000):
+        print(f'{iterations:>10} {run_loop(compiler, iterations):>12}'
+              f' {run_loop(UniformCostCompiler(), iterations):>15}')
+
+if __name__ == '__main__':
+    main([int(n) for n in sys.argv[1:]] or [500, 2000, 8000])
@@ -0,0 +1,129 @@
+import ast
+import hashlib
+import inspect
+import json
+import os
+import sys
+
+# The passes run in utils.compile and utils.compile_and_test.
+passes = ['shrink', 'uniquify', 'reveal_functions', 'resolve',
+          'check_bounds', 'erase_types', 'cast_insert', 'lower_casts',
+          'differentiate_proxies', 'reveal_casts', 'convert_assignments',
+          'convert_to_closures', 'limit_functions', 'expose_allocation',
+          'remove_complex_operands', 'explicate_control',
+          'select_instructions', 'assign_homes', 'patch_instructions',
+          'prelude_and_conclusion']
+
+# An on-disk cache of the x86 that a compiler generates for a program.
+#
+# An entry is keyed by a hash of the program's AST, the compiler's
+# class, the settings it lists in cache_settings, which passes it has,
+# and the source code of the modules that define it and of the modules
+# next to them, so that editing the compiler or the code it uses
+# invalidates its entries. The whole module is the unit of caching
+# rather than each function, as the passes work on the whole program.
+#
+# When the entries take more than max_bytes, the least recently used
+# ones are removed.
+class CompileCache:
+
+    def __init__(self, directory: str, max_bytes: int = 64 * 2 ** 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.saved_time = 0.0
+        self.skipped_passes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, compiler, program: ast.Module) -> str:
+        h = hashlib.sha256()
+        h.update(ast.dump(program).encode())
+        cls = type(compiler)
+        h.update((cls.__module__ + '.' + cls.__qualname__).encode())
+        # only the settings, not state that the passes leave behind
+        settings = getattr(compiler, 'cache_settings', [])
+        h.update(repr([(s, getattr(compiler, s)) for s in settings]).encode())
+        h.update(repr([p for p in passes if hasattr(compiler, p)]).encode())
+        for filename in self.source_files(cls):
+            h.update(filename.encode())
+            with open(filename, 'rb') as f:
+                h.update(f.read())
+        return h.hexdigest()
+
+    # The files defining the compiler's classes, and every loaded module
+    # in the same directories, as the passes also depend on modules such
+    # as utils.py, x86_ast.py, graph.py and dataflow_analysis.py. A
+    # module imported for the first time between two compilations
+    # changes the key, which costs a miss but never gives stale x86.
+    def source_files(self, cls) -> list[str]:
+        files = set()
+        for c in cls.__mro__:
+            try:
+                filename = inspect.getsourcefile(c)
+            except TypeError:
+                continue
+            if filename:
+                files.add(os.path.abspath(filename))
+        directories = {os.path.dirname(f) for f in files}
+        for module in list(sys.modules.values()):
+            filename = getattr(module, '__file__', None)
+            if filename and filename.endswith('.py'):
+                filename = os.path.abspath(filename)
+                if os.path.dirname(filename) in directories:
+                    files.add(filename)
+        return sorted(files)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.json')
+
+    # Returns the entry for the key, a dictionary with the x86 text and
+    # the number of passes recorded by put, or None on a miss. An entry
+    # without passes is a miss if needs_passes.
+    def get(self, key: str, needs_passes: bool = False):
+        path = self.path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            entry = None
+        if entry is None or (needs_passes and entry.get('passes') is None):
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        self.saved_time += entry['seconds']
+        self.skipped_passes += entry.get('passes') or 0
+        return entry
+
+    # Records the x86 text for the key and how many seconds it took to
+    # produce, which is what a later hit saves. compile_and_test also
+    # records the number of passes, which a hit skips.
+    def put(self, key: str, x86: str, seconds: float, passes=None):
+        path = self.path(key)
+        tmp = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'seconds': seconds, 'x86': x86, 'passes': passes}, f)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, name) in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+    def report(self) -> str:
+        lookups = self.hits + self.misses
+        rate = 100 * self.hits / lookups if lookups else 0
+        return 'compile cache: ' + repr(self.hits) + '/' + repr(lookups) \
+            + ' hits (' + format(rate, '.0f') + '%), saved ' \
+            + format(self.saved_time, '.2f') + 's and ' \
+            + repr(self.skipped_passes) + ' passes'
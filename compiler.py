@@ -11,6 +11,19 @@ Temporaries = List[Binding]
 
 class Compiler:
 
+    # The attributes that change the code the compiler generates, which
+    # CompileCache hashes into its keys.
+    cache_settings = []
+
+    def __init__(self):
+        self.name_supply = NameSupply()
+
+    # utils.compile and utils.compile_and_test call this before the
+    # first pass, so that each program gets a new name supply whichever
+    # pass is the first to generate names.
+    def begin_program(self):
+        self.name_supply = NameSupply()
+
     ############################################################################
     # Remove Complex Operands
     ############################################################################
@@ -27,14 +40,14 @@ class Compiler:
                 return (e, [])
             case Call(Name('input_int'), []):
                 if need_atomic:
-                    tmp = Name(generate_name())
+                    tmp = Name(self.name_supply.fresh())
                     return (tmp, [(tmp, e)])
                 else:
                     return (e, [])
             case UnaryOp(USub(), e):
                 e_atomic, tmps = self.rco_exp(e, True)
                 if need_atomic:
-                    tmp = Name(generate_name())
+                    tmp = Name(self.name_supply.fresh())
                     tmps.append((tmp, UnaryOp(USub(), e_atomic)))
                     return (tmp, tmps)
                 else:
@@ -43,7 +56,7 @@ class Compiler:
                e1_atomic, tmps1 = self.rco_exp(e1, True) 
                e2_atomic, tmps2 = self.rco_exp(e2, True)
                if need_atomic:
-                   tmp = Name(generate_name())
+                   tmp = Name(self.name_supply.fresh())
                    tmps = tmps1 + tmps2
                    tmps.append((tmp, BinOp(e1_atomic, op, e2_atomic)))
                    return (tmp, tmps)
@@ -82,8 +95,9 @@ class Compiler:
        match p:
            case Module(stmts):
                 res = []
-                for stmt in stmts:
-                    res.extend(self.rco_stmt(stmt))
+                with self.name_supply.function('main'):
+                    for stmt in stmts:
+                        res.extend(self.rco_stmt(stmt))
                 return Module(res)
            case _:
                raise Exception('unhandled case')
@@ -143,11 +157,11 @@ class Compiler:
                         ]
                     case BinOp(Name(arg1), Add(), atm2) if lhs == arg1:
                         return [
-                            Instr('addq', self.select_arg(atm2), Variable(lhs))
+                            Instr('addq', [self.select_arg(atm2), Variable(lhs)])
                         ]
                     case BinOp(atm1, Add(), Name(arg2)) if lhs == arg2:
                         return [
-                            Instr('addq', self.select_arg(atm1), Variable(arg2))
+                            Instr('addq', [self.select_arg(atm1), Variable(lhs)])
                         ]
                     case BinOp(atm1, Add(), atm2):
                         return [
@@ -156,7 +170,7 @@ class Compiler:
                         ]
                     case BinOp(Name(atm1), Sub(), atm2) if lhs == atm1:
                         return [
-                            Instr('subq', self.select_arg(atm2), Variable(lhs))
+                            Instr('subq', [self.select_arg(atm2), Variable(lhs)])
                         ]
                     case BinOp(atm1, Sub(), atm2):
                         return [
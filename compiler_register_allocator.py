@@ -1,29 +1,140 @@
 import compiler
-from graph import UndirectedAdjList
-from typing import List, Tuple, Set, Dict
+from graph import UndirectedAdjList, DirectedAdjList, transpose
+from dataflow_analysis import analyze_dataflow
 from ast import *
 from x86_ast import *
-from typing import Set, Dict, Tuple
+from typing import List, Set, Dict, Tuple
+from utils import align, trace, label_name
+from bisect import bisect_left
+import heapq
+from itertools import count
 
 # Skeleton code for the chapter on Register Allocation
 
+caller_saved_registers = \
+    {Reg('rax'), Reg('rcx'), Reg('rdx'), Reg('rsi'), Reg('rdi'),
+     Reg('r8'), Reg('r9'), Reg('r10'), Reg('r11')}
+
+arg_registers = \
+    [Reg('rdi'), Reg('rsi'), Reg('rdx'), Reg('rcx'), Reg('r8'), Reg('r9')]
+
+callee_saved_registers = \
+    {Reg('rbx'), Reg('r12'), Reg('r13'), Reg('r14'), Reg('r15')}
+
+# The registers handed out by the allocator, indexed by color. rax and
+# r11 are left free for patch_instructions and r15 is kept for the root
+# stack. The caller-saved registers come first so that they are
+# preferred: a callee-saved register costs a push and a pop, but it is
+# the only kind of register a variable that is live across a call can
+# be given.
+allocatable_registers = \
+    [Reg('rcx'), Reg('rdx'), Reg('rsi'), Reg('rdi'),
+     Reg('r8'), Reg('r9'), Reg('r10'),
+     Reg('rbx'), Reg('r12'), Reg('r13'), Reg('r14')]
+
+register_color = \
+    {r: c for (c, r) in enumerate(allocatable_registers)}
+
+
 class Compiler(compiler.Compiler):
 
+    # The body of an X86Program is either a list of instructions or,
+    # once there is control flow, a dictionary of labeled blocks.
+    def instructions(self, p: X86Program) -> List[instr]:
+        if isinstance(p.body, dict):
+            return [i for ss in p.body.values() for i in ss]
+        else:
+            return p.body
+
+    def entry_label(self, p: X86Program) -> str:
+        if label_name('start') in p.body:
+            return label_name('start')
+        else:
+            return next(iter(p.body))
+
+    def control_flow_graph(self, p: X86Program) -> DirectedAdjList:
+        cfg = DirectedAdjList()
+        for (label, ss) in p.body.items():
+            cfg.add_vertex(label)
+            for i in ss:
+                match i:
+                    case Jump(target) | JumpIf(_, target) \
+                            if target in p.body:
+                        cfg.add_edge(label, target)
+        return cfg
+
     ###########################################################################
     # Uncover Live
     ###########################################################################
 
+    def arg_locations(self, a: arg) -> Set[location]:
+        match a:
+            case Variable(_) | Reg(_):
+                return {a}
+            case _:
+                return set()
+
     def read_vars(self, i: instr) -> Set[location]:
-        # YOUR CODE HERE
-        pass
+        match i:
+            case Instr('movq' | 'movzbq', [s, d]):
+                return self.arg_locations(s)
+            case Instr('addq' | 'subq' | 'xorq' | 'cmpq', [s, d]):
+                return self.arg_locations(s) | self.arg_locations(d)
+            case Instr('negq' | 'pushq', [d]):
+                return self.arg_locations(d)
+            case Callq(_, num_args):
+                return set(arg_registers[:num_args])
+            case _:
+                return set()
 
     def write_vars(self, i: instr) -> Set[location]:
-        # YOUR CODE HERE
-        pass
+        match i:
+            case Instr('cmpq' | 'pushq', _):
+                return set()
+            case Instr(_, [*_, d]):
+                return self.arg_locations(d)
+            case Callq(_, _):
+                return set(caller_saved_registers)
+            case _:
+                return set()
+
+    # What is live on entry to the conclusion, which is reached by
+    # jumping to a label that is not one of the program's blocks.
+    def live_at_exit(self) -> Set[location]:
+        return {Reg('rax')}
 
     def uncover_live(self, p: X86Program) -> Dict[instr, Set[location]]:
-        # YOUR CODE HERE
-        pass
+        live_after = {}
+        live_before_block = {}
+
+        def live_before(target):
+            if isinstance(p.body, dict) and target in p.body:
+                return live_before_block.get(target, set())
+            else:
+                return self.live_at_exit()
+
+        def transfer(label, _):
+            live = set()
+            ss = p.body[label] if isinstance(p.body, dict) else p.body
+            for i in reversed(ss):
+                live_after[i] = live
+                match i:
+                    case Jump(target):
+                        live = live_before(target)
+                    case JumpIf(_, target):
+                        live = live | live_before(target)
+                    case _:
+                        live = (live - self.write_vars(i)) | self.read_vars(i)
+            live_before_block[label] = live
+            return live
+
+        if isinstance(p.body, dict):
+            cfg = self.control_flow_graph(p)
+            analyze_dataflow(transpose(cfg), transfer, set(),
+                             lambda x, y: x | y)
+        else:
+            transfer(None, set())
+        return live_after
 
     ############################################################################
     # Build Interference
@@ -31,44 +142,402 @@ class Compiler(compiler.Compiler):
 
     def build_interference(self, p: X86Program,
                            live_after: Dict[instr, Set[location]]) -> UndirectedAdjList:
-        # YOUR CODE HERE
-        pass
+        graph = UndirectedAdjList()
+        for i in self.instructions(p):
+            for v in self.read_vars(i) | self.write_vars(i):
+                graph.add_vertex(v)
+            match i:
+                case Instr('movq' | 'movzbq', [s, d]):
+                    for v in live_after[i]:
+                        if v != s and v != d and not graph.has_edge(d, v):
+                            graph.add_edge(d, v)
+                case _:
+                    for d in self.write_vars(i):
+                        for v in live_after[i]:
+                            if v != d and not graph.has_edge(d, v):
+                                graph.add_edge(d, v)
+        return graph
+
+    # Connects the two sides of every move between locations, so that the
+    # allocator can try to give them the same home and the move can be
+    # deleted in patch_instructions.
+    def build_move_graph(self, p: X86Program) -> UndirectedAdjList:
+        graph = UndirectedAdjList()
+        for i in self.instructions(p):
+            match i:
+                case Instr('movq', [Variable(_) | Reg(_) as s,
+                                    Variable(_) | Reg(_) as d]) if s != d:
+                    if not graph.has_edge(s, d):
+                        graph.add_edge(s, d)
+        return graph
+
+    ############################################################################
+    # Spill Costs
+    ############################################################################
+
+    # A use or definition inside n nested loops counts loop_weight ** n
+    # times.
+    loop_weight = 10
+
+    # The spill cost of a variable is what keeping it in a register
+    # saves, and the variables with the lowest cost are spilled first.
+    # A variable that is live across a call cannot stay in a register
+    # that the call clobbers, and a callee-saved register costs the
+    # prelude a push and a pop, so keeping it in a register saves less.
+    # Each call it crosses is therefore subtracted from its cost, making
+    # it a cheaper spill than a variable used as often that crosses no
+    # calls.
+    call_crossing_penalty = 1
+
+    # The loop nesting depth of each block, where the loops are the
+    # natural loops of the back edges found by a depth-first search of
+    # the control-flow graph from the entry block.
+    def loop_depths(self, p: X86Program) -> Dict[str, int]:
+        if not isinstance(p.body, dict):
+            return {}
+        cfg = self.control_flow_graph(p)
+        preds = transpose(cfg)
+        entry = self.entry_label(p)
+        back_edges = []
+        on_path = {entry}
+        visited = {entry}
+        stack = [(entry, iter(cfg.adjacent(entry)))]
+        while stack:
+            (u, succs) = stack[-1]
+            v = next(succs, None)
+            if v is None:
+                stack.pop()
+                on_path.remove(u)
+            elif v in on_path:
+                back_edges.append((u, v))
+            elif v not in visited:
+                visited.add(v)
+                on_path.add(v)
+                stack.append((v, iter(cfg.adjacent(v))))
+        loops = {}
+        for (tail, header) in back_edges:
+            body = loops.setdefault(header, {header})
+            work = [tail]
+            while work:
+                u = work.pop()
+                if u not in body:
+                    body.add(u)
+                    work.extend(preds.adjacent(u))
+        depth = {label: 0 for label in p.body}
+        for body in loops.values():
+            for label in body:
+                depth[label] += 1
+        return depth
+
+    def spill_costs(self, p: X86Program,
+                    live_after: Dict[instr, Set[location]]) -> Dict[location, float]:
+        if isinstance(p.body, dict):
+            depth = self.loop_depths(p)
+            blocks = [(depth[l], ss) for (l, ss) in p.body.items()]
+        else:
+            blocks = [(0, p.body)]
+        cost = {}
+        for (d, ss) in blocks:
+            weight = self.loop_weight ** d
+            for i in ss:
+                for v in self.read_vars(i) | self.write_vars(i):
+                    if isinstance(v, Variable):
+                        cost[v] = cost.get(v, 0) + weight
+                if isinstance(i, Callq):
+                    for v in live_after[i]:
+                        if isinstance(v, Variable):
+                            cost[v] = cost.get(v, 0) \
+                                - self.call_crossing_penalty * weight
+        return cost
 
     ############################################################################
     # Allocate Registers
     ############################################################################
 
+    # Prefers a register that a move-related location already has, when
+    # it is one of the candidates, and otherwise the smallest candidate.
+    def choose_color(self, v: location, candidates,
+                     coloring: Dict[location, int],
+                     move_graph: UndirectedAdjList) -> int:
+        if move_graph is not None and v in move_graph.out:
+            biased = [c for u in move_graph.adjacent(v)
+                      for c in [coloring.get(u, register_color.get(u))]
+                      if c is not None and c in candidates
+                      and c < len(allocatable_registers)]
+            if biased:
+                return min(biased)
+        return min(candidates)
+
     # Returns the coloring and the set of spilled variables.
+    #
+    # Variables with fewer than k neighbors are removed from the graph
+    # first, since they can always be colored. When none is left, the
+    # variable with the lowest spill cost per neighbor is removed as a
+    # potential spill. Colors are then assigned in the reverse order of
+    # removal, and a potential spill only ends up on the stack if its
+    # neighbors took every register.
     def color_graph(self, graph: UndirectedAdjList,
-                    variables: Set[location]) -> Tuple[Dict[location, int], Set[location]]:
-        # YOUR CODE HERE
-        pass
+                    variables: Set[location],
+                    move_graph: UndirectedAdjList = None,
+                    spill_cost: Dict[location, float] = None) \
+            -> Tuple[Dict[location, int], Set[location]]:
+        k = len(allocatable_registers)
+        neighbors = {v: set(graph.adjacent(v)) for v in variables}
+        degree = {v: len([u for u in neighbors[v]
+                          if u in variables or u in register_color])
+                  for v in variables}
+        remaining = sorted(variables, key=str)
+
+        def priority(v):
+            return ((spill_cost.get(v, 0) if spill_cost else 1) / degree[v],
+                    str(v), degree[v], v)
+
+        # low is a worklist of the variables with fewer than k neighbors
+        # and high a heap of the others by spill cost per neighbor. An
+        # entry is stale, and skipped, once its variable is removed or,
+        # in the heap, its degree has changed since it was pushed.
+        low = [v for v in remaining if degree[v] < k]
+        high = [priority(v) for v in remaining if degree[v] >= k]
+        heapq.heapify(high)
+        removed = set()
+        stack = []
+        while len(stack) < len(remaining):
+            while low and low[-1] in removed:
+                low.pop()
+            if low:
+                v = low.pop()
+            else:
+                while True:
+                    (_, _, d, v) = heapq.heappop(high)
+                    if v not in removed and d == degree[v]:
+                        break
+            removed.add(v)
+            stack.append(v)
+            for u in neighbors[v]:
+                if u in degree and u not in removed:
+                    degree[u] -= 1
+                    if degree[u] == k - 1:
+                        low.append(u)
+                    elif degree[u] >= k:
+                        heapq.heappush(high, priority(u))
+
+        coloring = {}
+        for v in reversed(stack):
+            taken = {coloring.get(u, register_color.get(u))
+                     for u in neighbors[v]}
+            free = [c for c in range(k) if c not in taken]
+            if free:
+                coloring[v] = self.choose_color(v, free, coloring, move_graph)
+            else:
+                coloring[v] = next(c for c in count(k) if c not in taken)
+        spilled = {v for v in variables if coloring[v] >= k}
+        return (coloring, spilled)
+
+    # The spill slots start below the callee-saved registers that the
+    # prelude pushes right after rbp.
+    def color_location(self, c: int, num_callee: int = 0) -> arg:
+        k = len(allocatable_registers)
+        if c < k:
+            return allocatable_registers[c]
+        else:
+            return Deref('rbp', - 8 * (num_callee + c - k + 1))
+
+    def assign_colors(self, p: X86Program,
+                      coloring: Dict[location, int]) -> X86Program:
+        used = {allocatable_registers[c] for c in coloring.values()
+                if c < len(allocatable_registers)}
+        # recorded on the program, like its stack_space, for
+        # prelude_and_conclusion to save and restore
+        p.used_callee = [r for r in allocatable_registers
+                         if r in used and r in callee_saved_registers]
+        num_callee = len(p.used_callee)
+        home = {v: self.color_location(c, num_callee)
+                for (v, c) in coloring.items()}
+        if isinstance(p.body, dict):
+            p.body = {l: self.assign_homes_instrs(ss, home)
+                      for (l, ss) in p.body.items()}
+        else:
+            p.body = self.assign_homes_instrs(p.body, home)
+        spill_slots = max([c - len(allocatable_registers) + 1
+                           for c in coloring.values()] + [0])
+        # rsp is 16-byte aligned after pushing rbp, and has to be again
+        # after pushing the callee-saved registers and making room for
+        # the spills.
+        callee_space = 8 * num_callee
+        p.stack_space = align(8 * spill_slots + callee_space, 16) \
+            - callee_space
+        return p
 
     def allocate_registers(self, p: X86Program,
-                           graph: UndirectedAdjList) -> X86Program:
-        # YOUR CODE HERE
-        pass
+                           graph: UndirectedAdjList,
+                           live_after: Dict[instr, Set[location]] = None) \
+            -> X86Program:
+        variables = {v for v in graph.vertices() if isinstance(v, Variable)}
+        move_graph = self.build_move_graph(p)
+        spill_cost = self.spill_costs(p, live_after) if live_after else None
+        (coloring, spilled) = self.color_graph(graph, variables, move_graph,
+                                               spill_cost)
+        return self.assign_colors(p, coloring)
+
+    ############################################################################
+    # Linear Scan
+    ############################################################################
+
+    # Functions with more instructions than this are allocated by linear
+    # scan (Poletto and Sarkar) instead of graph coloring. Linear scan
+    # never builds the interference graph, so it stays fast on very
+    # large functions. What it gives up is the choice of what to spill:
+    # it spills the interval that ends last rather than the variable
+    # with the lowest spill cost, so it may spill a variable used in a
+    # loop that coloring would keep in a register, and with no interval
+    # splitting a spilled variable stays on the stack for its whole
+    # lifetime, in a stack slot of its own.
+    linear_scan_threshold = 1000
+
+    cache_settings = compiler.Compiler.cache_settings \
+        + ['linear_scan_threshold']
+
+    # Instruction n reads its operands at point 2n and writes its
+    # results at point 2n + 1. Returns the interval of points that each
+    # variable covers and, for each register, the sorted points at
+    # which it is in use.
+    def live_intervals(self, p: X86Program,
+                       live_after: Dict[instr, Set[location]]) \
+            -> Tuple[Dict[location, Tuple[int, int]], Dict[location, List[int]]]:
+        intervals = {}
+        reg_points = {}
+
+        def occupy(v, point):
+            if isinstance(v, Reg):
+                reg_points.setdefault(v, []).append(point)
+            elif v in intervals:
+                (start, end) = intervals[v]
+                intervals[v] = (min(start, point), max(end, point))
+            else:
+                intervals[v] = (point, point)
+        for (n, i) in enumerate(self.instructions(p)):
+            for v in self.read_vars(i):
+                occupy(v, 2 * n)
+            for v in self.write_vars(i) | live_after[i]:
+                occupy(v, 2 * n + 1)
+        return (intervals, reg_points)
+
+    # Returns the coloring and the set of spilled variables, like
+    # color_graph.
+    def linear_scan(self, intervals: Dict[location, Tuple[int, int]],
+                    reg_points: Dict[location, List[int]],
+                    move_graph: UndirectedAdjList = None) \
+            -> Tuple[Dict[location, int], Set[location]]:
+        k = len(allocatable_registers)
+
+        def blocked(c, start, end):
+            points = reg_points.get(allocatable_registers[c], [])
+            n = bisect_left(points, start)
+            return n < len(points) and points[n] <= end
+
+        coloring = {}
+        spilled = []
+        active = []
+        free = set(range(k))
+        for v in sorted(intervals, key=lambda v: (intervals[v], str(v))):
+            (start, end) = intervals[v]
+            for u in [u for u in active if intervals[u][1] < start]:
+                active.remove(u)
+                free.add(coloring[u])
+            usable = [c for c in free if not blocked(c, start, end)]
+            if usable:
+                coloring[v] = self.choose_color(v, usable, coloring, move_graph)
+                free.remove(coloring[v])
+                active.append(v)
+                continue
+            # No register is free for the whole interval: spill whichever
+            # of v and the active intervals it could take a register from
+            # ends last.
+            candidates = [u for u in active
+                          if not blocked(coloring[u], start, end)]
+            u = max(candidates, key=lambda u: intervals[u][1], default=None)
+            if u is not None and intervals[u][1] > end:
+                coloring[v] = coloring[u]
+                active.remove(u)
+                active.append(v)
+                spilled.append(u)
+            else:
+                spilled.append(v)
+        for (n, v) in enumerate(spilled):
+            coloring[v] = k + n
+        return (coloring, set(spilled))
+
+    def allocate_registers_linear_scan(self, p: X86Program,
+                                       live_after: Dict[instr, Set[location]]) \
+            -> X86Program:
+        (intervals, reg_points) = self.live_intervals(p, live_after)
+        move_graph = self.build_move_graph(p)
+        (coloring, spilled) = self.linear_scan(intervals, reg_points, move_graph)
+        return self.assign_colors(p, coloring)
 
     ############################################################################
     # Assign Homes
     ############################################################################
 
     def assign_homes(self, pseudo_x86: X86Program) -> X86Program:
-        # YOUR CODE HERE
-        pass
+        live_after = self.uncover_live(pseudo_x86)
+        if len(self.instructions(pseudo_x86)) > self.linear_scan_threshold:
+            return self.allocate_registers_linear_scan(pseudo_x86, live_after)
+        graph = self.build_interference(pseudo_x86, live_after)
+        return self.allocate_registers(pseudo_x86, graph, live_after)
 
     ###########################################################################
     # Patch Instructions
     ###########################################################################
 
+    def is_redundant_move(self, i: instr) -> bool:
+        match i:
+            case Instr('movq', [s, d]):
+                return s == d
+            case _:
+                return False
+
     def patch_instructions(self, p: X86Program) -> X86Program:
-        # YOUR CODE HERE
-        pass
+        removed = 0
+        if isinstance(p.body, dict):
+            body = {}
+            for (l, ss) in p.body.items():
+                kept = [i for i in ss if not self.is_redundant_move(i)]
+                removed += len(ss) - len(kept)
+                body[l] = self.patch_instrs(kept)
+            p.body = body
+        else:
+            kept = [i for i in p.body if not self.is_redundant_move(i)]
+            removed += len(p.body) - len(kept)
+            p.body = self.patch_instrs(kept)
+        trace('patch_instructions: removed ' + str(removed)
+              + ' redundant moves')
+        return p
 
     ###########################################################################
     # Prelude & Conclusion
     ###########################################################################
 
+    # Only the callee-saved registers that the allocator handed out are
+    # saved and restored.
     def prelude_and_conclusion(self, p: X86Program) -> X86Program:
-        # YOUR CODE HERE
-        pass
+        used_callee = p.used_callee
+        prelude = [
+            Instr('pushq', [Reg('rbp')]),
+            Instr('movq', [Reg('rsp'), Reg('rbp')])
+        ] + [Instr('pushq', [r]) for r in used_callee] + [
+            Instr('subq', [Immediate(p.stack_space), Reg('rsp')])
+        ]
+        conclusion = [
+            Instr('addq', [Immediate(p.stack_space), Reg('rsp')])
+        ] + [Instr('popq', [r]) for r in reversed(used_callee)] + [
+            Instr('popq', [Reg('rbp')]),
+            Instr('retq', [])
+        ]
+        if not isinstance(p.body, dict):
+            p.body = prelude + p.body + conclusion
+            return p
+        p.body = {label_name('main'): prelude + [Jump(self.entry_label(p))],
+                  **p.body,
+                  label_name('conclusion'): conclusion}
+        return p
@@ -1,17 +1,15 @@
 from ast import *
 from interp_Ctup import InterpCtup
 from utils import *
+import operator
 
 class InterpCarray(InterpCtup):
+  binary_functions = {**InterpCtup.binary_functions, Mult: operator.mul}
 
   def interp_exp(self, e, env):
     match e:
       case ast.List(es, Load()):
         return [self.interp_exp(e, env) for e in es]
-      case BinOp(left, Mult(), right):
-          l = self.interp_exp(left, env)
-          r = self.interp_exp(right, env)
-          return l * r
       case AllocateArray(length, typ):
         array = [None] * length
         return array
@@ -1,26 +1,57 @@
 from ast import *
 from interp_Carray import InterpCarray
 from utils import *
-from interp_Lfun import Function
+from interp_Lfun import Function, Frame, unassigned, frame_layout, \
+  resolve_names, lookup
+
+# What the body of a function returns when it ends in a TailCall: the
+# call that apply_fun has to make next, in place of the current one.
+class PendingCall:
+  __slots__ = ('fun', 'args')
+  def __init__(self, fun, args):
+    self.fun = fun
+    self.args = args
+  def __repr__(self):
+    return 'PendingCall(' + repr(self.fun) + ', ' + repr(self.args) + ')'
 
 class InterpCfun(InterpCarray):
 
+  # Calls the function and then any function it tail calls, one after
+  # the other, so that a chain of tail calls runs in constant Python
+  # stack.
   def apply_fun(self, fun, args, e):
+      result = self.enter_fun(fun, args, e)
+      while isinstance(result, PendingCall):
+          result = self.enter_fun(result.fun, result.args, e)
+      return result
+
+  # Runs the body of the function, which returns a value or a
+  # PendingCall. Override this, rather than apply_fun, to add kinds of
+  # functions.
+  def enter_fun(self, fun, args, e):
       match fun:
         case Function(name, xs, blocks, env):
           old_blocks = self.blocks
           self.blocks = blocks
-          new_env = {x: v for (x,v) in env.items()}
-          for (x,arg) in zip(xs, args):
-              new_env[x] = arg
+          layout = fun.layout
+          if layout is None:
+              layout = fun.layout = frame_layout(xs, self.block_stmts(blocks))
+          values = list(args)
+          values.extend([unassigned] * (len(layout) - len(values)))
+          new_env = Frame(layout, values, env)
           ret = self.interp_stmts(blocks[label_name(name + '_start')], new_env)
           self.blocks = old_blocks
           return ret
         case _:
-          raise Exception('apply_fun: unexpected: ' + repr(fun))
+          raise Exception('enter_fun: unexpected: ' + repr(fun))
     
+  def block_stmts(self, blocks):
+    return [s for ss in blocks.values() for s in ss]
+
   def interp_exp(self, e, env):
     match e:
+      case Name(id):
+        return lookup(e, env)
       case Call(Name(f), args) if f in builtin_functions:
         return super().interp_exp(e, env)      
       case Call(func, args):
@@ -35,7 +66,9 @@ class InterpCfun(InterpCarray):
   def interp_tail(self, s, env):
     match s:
       case TailCall(func, args):
-        return self.interp_exp(Call(func, args), env)
+        f = self.interp_exp(func, env)
+        vs = [self.interp_exp(arg, env) for arg in args]
+        return PendingCall(f, vs)
       case _:
         return super().interp_tail(s, env)
       
@@ -46,7 +79,11 @@ class InterpCfun(InterpCarray):
         for d in defs:
             match d:
               case FunctionDef(name, params, blocks, dl, returns, comment):
-                env[name] = Function(name, [x for (x,t) in params], blocks, env)
+                xs = [x for (x,t) in params]
+                layout = frame_layout(xs, self.block_stmts(blocks))
+                for s in self.block_stmts(blocks):
+                  resolve_names(s, [layout])
+                env[name] = Function(name, xs, blocks, env, layout)
         self.blocks = {}
         self.apply_fun(env['main'], [], None)
       case _:
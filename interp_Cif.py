@@ -11,25 +11,34 @@ class InterpCif(InterpLif):
         self.blocks = blocks
         self.interp_stmts(blocks[label_name('start')], env)
 
+  # Runs the statements of a block and then its tail. A tail that
+  # jumps returns the Goto, and the loop goes on with the statements
+  # of its target, so jumping from block to block does not use up the
+  # Python stack. Returns the value of the Return that ends the
+  # program or function.
   def interp_stmts(self, ss, env):
-    match ss:
-      case [t]:
-        return self.interp_tail(t, env)
-      case [s, *ss]:
-        self.interp_stmt(s, env, [])
-        return self.interp_stmts(ss, env)
+    while ss:
+      for i in range(len(ss) - 1):
+        self.interp_stmt(ss[i], env, [])
+      result = self.interp_tail(ss[-1], env)
+      if not isinstance(result, Goto):
+        return result
+      ss = self.blocks[result.label]
+    return None
 
+  # Returns the value of a Return, or the Goto for the block to run
+  # next.
   def interp_tail(self, s, env):
     match s:
       case Return(value):
         return self.interp_exp(value, env)
       case Goto(label):
-        return self.interp_stmts(self.blocks[label], env)
-      case If(test, [Goto(thn)], [Goto(els)]):
+        return s
+      case If(test, [Goto(thn) as thn_goto], [Goto(els) as els_goto]):
         match self.interp_exp(test, env):
           case True:
-            return self.interp_stmts(self.blocks[thn], env)
+            return thn_goto
           case False:
-            return self.interp_stmts(self.blocks[els], env)
+            return els_goto
       case _:
         raise Exception('interp_tail: unexpected ' + repr(s))
@@ -6,12 +6,12 @@ from utils import *
 
 class InterpCproxy(InterpCany):
 
-  def apply_fun(self, fun, args, e):
+  def enter_fun(self, fun, args, e):
       match fun:
         case ClosureTuple(elts, arity):
-          return self.apply_fun(elts[0], [elts] + args, e)
+          return self.enter_fun(elts[0], [elts] + args, e)
         case _:
-          return super().apply_fun(fun, args, e)
+          return super().enter_fun(fun, args, e)
       
   def type_to_tag(self, typ):
       match typ:
@@ -1,16 +1,11 @@
 from ast import *
 from interp_Cif import InterpCif
 from utils import *
+import operator
 
 class InterpCtup(InterpCif):
+  compare_functions = {**InterpCif.compare_functions, Is: operator.is_}
 
-  def interp_cmp(self, cmp):
-    match cmp:
-      case Is():
-        return lambda x, y: x is y
-      case _:
-        return super().interp_cmp(cmp)
-      
   def interp_exp(self, e, env):
     match e:
       case Tuple(es, Load()):
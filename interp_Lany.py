@@ -119,6 +119,7 @@ class InterpLany(InterpLlambda):
           case _:
             raise Exception('interp ValueOf unexpected ' + repr(v))
       case AnnLambda(params, returns, body):
-        return Function('lambda', [x for (x,t) in params], [Return(body)], env)
+        return Function('lambda', [x for (x,t) in params], [Return(body)], env,
+                        getattr(e, 'layout', None))
       case _:
         return super().interp_exp(e, env)
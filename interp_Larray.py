@@ -3,14 +3,12 @@ from interp_Ltup import InterpLtup
 from utils import *
 
 class InterpLarray(InterpLtup):
+  binary_functions = {**InterpLtup.binary_functions, Mult: mul64}
 
   def interp_exp(self, e, env):
     match e:
       case ast.List(es, Load()):
         return [self.interp_exp(e, env) for e in es]
-      case BinOp(left, Mult(), right):
-          l = self.interp_exp(left, env); r = self.interp_exp(right, env)
-          return mul64(l, r)
       case Subscript(tup, index, Load()):
         t = self.interp_exp(tup, env)
         n = self.interp_exp(index, env)
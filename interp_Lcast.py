@@ -1,12 +1,139 @@
 from ast import *
-from interp_Lfun import Function
+from dataclasses import dataclass
+from interp_Lfun import Function, frame_layout, resolve_names
 from interp_Llambda import InterpLlambda, ClosureTuple
 from interp_Lany import InterpLany
 from interp_Ldyn import Tagged
+from type_check_Lgrad import TypeCheckLgrad
 from utils import *
-    
+
+# A cast to a function, tuple, or list type wraps the value in a
+# Function or proxy that casts what flows through it. The wrapper
+# records the cast as a threesome, in its `cast` attribute: the
+# unwrapped value, the type it had, and the meet of the types it has
+# been cast through. Casting a wrapper
+# again composes the two casts into one threesome around the unwrapped
+# value instead of adding a layer, so a value that crosses between
+# typed and untyped code any number of times is wrapped at most once
+# (space-efficient casts, as in Siek and Wadler's threesomes).
+
+# The meet of two inconsistent types, e.g. of int and bool. A cast
+# through it fails when a value reaches it, as the chain of casts it
+# stands for would have failed at the cast between the two types. A
+# cast whose whole mid type is Inconsistent() fails right away.
+@interned
+@dataclass(eq=True)
+class Inconsistent(Type):
+  def __str__(self):
+    return 'inconsistent'
+
+# Casts e from source to target by way of mid.
+def cast_through(e, source, mid, target):
+  if mid == Inconsistent():
+    return Cast(e, source, mid)
+  elif mid == source or mid == target:
+    return Cast(e, source, target)
+  else:
+    return Cast(Cast(e, source, mid), mid, target)
+
 class InterpLcast(InterpLany):
 
+  # Turn off to get one wrapper per cast, e.g. for benchmarking.
+  collapse_casts = True
+
+  def __init__(self):
+    self.type_checker = TypeCheckLgrad()
+    # (source, mid, target) -> what make_cast_closures built for it
+    self.cast_closure_table = {}
+
+  # Combines two consistent types into one at least as precise as both,
+  # taking the more precise type at each position (so Any only where
+  # both have Any), as join_types does. That is the mid type of the
+  # composed threesome. Where the types are inconsistent, the meet has
+  # Inconsistent() instead, so that only a value that gets there fails.
+  def meet(self, t1, t2):
+    if self.type_checker.consistent(t1, t2):
+      return self.type_checker.join_types(t1, t2)
+    match (t1, t2):
+      case (FunctionType(ps1, rt1), FunctionType(ps2, rt2)) \
+          if len(ps1) == len(ps2):
+        return FunctionType([self.meet(p1, p2) for (p1, p2) in zip(ps1, ps2)],
+                            self.meet(rt1, rt2))
+      case (TupleType(ts1), TupleType(ts2)) if len(ts1) == len(ts2):
+        return TupleType([self.meet(ty1, ty2) for (ty1, ty2) in zip(ts1, ts2)])
+      case (ListType(ty1), ListType(ty2)):
+        return ListType(self.meet(ty1, ty2))
+      case _:
+        return Inconsistent()
+
+  # Returns the threesome (value, source, mid) for casting the value to
+  # the target, unwrapping the value if it is the result of a cast.
+  def compose_cast(self, value, source, target):
+    cast = getattr(value, 'cast', None)
+    if self.collapse_casts and cast is not None:
+      (value, source, mid) = cast
+      return (value, source, self.meet(mid, target))
+    else:
+      return (value, source, self.meet(source, target))
+
+  # Turn off to build the closures of every cast afresh.
+  cache_casts = True
+
+  # The table is emptied when it reaches this many entries, like the
+  # memo tables of TypeCheckLgrad.
+  table_limit = 4096
+
+  def cast_closures(self, source, mid, target):
+    key = (source, mid, target)
+    table = self.cast_closure_table
+    closures = table.get(key) if self.cache_casts else None
+    if closures is None:
+      closures = self.make_cast_closures(source, mid, target)
+      if self.cache_casts:
+        if len(table) >= self.table_limit:
+          table.clear()
+        table[key] = closures
+    return closures
+
+  # Builds the parts of a cast that depend only on its types, so they
+  # can be shared by every value that is cast the same way. For a
+  # function type, that is the parameters, body and frame layout of the
+  # wrapper, which calls the wrapped function through the variable fun
+  # of its environment. For a tuple type, it is a read Function per
+  # element, and for a list type, a read and a write Function.
+  def make_cast_closures(self, source, mid, target):
+    match (source, target):
+      case (FunctionType(ps0, rt0), FunctionType(ps2, rt2)):
+        ms = mid.param_types
+        params = [generate_name('x') for p in ps2]
+        args = [cast_through(Name(x), t2, m, t0)
+                for (x, t2, m, t0) in zip(params, ps2, ms, ps0)]
+        body = [Return(cast_through(Call(Name('fun'), args), rt0,
+                                    mid.ret_type, rt2))]
+        return (params, body, self.closure_layout(params, body))
+      case (TupleType(ts0), TupleType(ts2)):
+        ms = mid.types
+        return [self.cast_function(t0, m, t2)
+                for (t0, m, t2) in zip(ts0, ms, ts2)]
+      case (ListType(t0), ListType(t2)):
+        m = mid.elt_type
+        return (self.cast_function(t0, m, t2),
+                self.cast_function(t2, m, t0))
+      case _:
+        raise Exception('make_cast_closures unexpected ' + repr(source)
+                        + ' ' + repr(target))
+
+  def closure_layout(self, params, body):
+    layout = frame_layout(params, body)
+    for s in body:
+      resolve_names(s, [layout])
+    return layout
+
+  def cast_function(self, source, mid, target):
+    x = generate_name('x')
+    body = [Return(cast_through(Name(x), source, mid, target))]
+    return Function('cast', [x], body, {}, self.closure_layout([x], body))
+
   def apply_inject(self, value, source):
     return Tagged(value, self.type_to_tag(source))
 
@@ -19,6 +146,9 @@ class InterpLcast(InterpLany):
         
   def apply_cast(self, value, source, target):
     match (source, target):
+      case (_, Inconsistent()):
+        raise Exception('apply_cast, inconsistent cast from '
+                        + repr(source))
       case (AnyType(), FunctionType(ps2, rt2)):
         anyfun = FunctionType([AnyType() for p in ps2], AnyType())
         return self.apply_cast(self.apply_project(value, anyfun),
@@ -28,7 +158,7 @@ class InterpLcast(InterpLany):
         return self.apply_cast(self.apply_project(value, anytup),
                                anytup, target)
       case (AnyType(), ListType(t2)):
-        anylist = ListType([AnyType() for t1 in ts2])
+        anylist = ListType(AnyType())
         return self.apply_cast(self.apply_project(value, anylist),
                                anylist, target)
       case (AnyType(), AnyType()):
@@ -47,21 +177,34 @@ class InterpLcast(InterpLany):
       case (_, AnyType()):
         return self.apply_inject(value, source)
       case (FunctionType(ps1, rt1), FunctionType(ps2, rt2)):
-        params = [generate_name('x') for p in ps2]
-        args = [Cast(Name(x), t2, t1)
-                for (x,(t1,t2)) in zip(params, zip(ps1, ps2))]
-        body = Cast(Call(ValueExp(value), args), rt1, rt2)
-        return Function('cast', params, [Return(body)], {})
+        (value, source, mid) = self.compose_cast(value, source, target)
+        if mid == Inconsistent():
+          return self.apply_cast(value, source, mid)
+        if source == target and mid == target:
+          return value
+        (params, body, layout) = self.cast_closures(source, mid, target)
+        f = Function('cast', params, body, {'fun': value}, layout)
+        f.cast = (value, source, mid)
+        return f
       case (TupleType(ts1), TupleType(ts2)):
-        x = generate_name('x')
-        reads = [Function('cast', [x], [Return(Cast(Name(x), t1, t2))], {})
-                 for (t1,t2) in zip(ts1,ts2)]
-        return ProxiedTuple(value, reads)
+        (value, source, mid) = self.compose_cast(value, source, target)
+        if mid == Inconsistent():
+          return self.apply_cast(value, source, mid)
+        if source == target and mid == target:
+          return value
+        proxy = ProxiedTuple(value, self.cast_closures(source, mid, target))
+        proxy.cast = (value, source, mid)
+        return proxy
       case (ListType(t1), ListType(t2)):
-        x = generate_name('x')
-        read = Function('cast', [x], [Return(Cast(Name(x), t1, t2))], {})
-        write = Function('cast', [x], [Return(Cast(Name(x), t2, t1))], {})
-        return ProxiedList(value, read, write)
+        (value, source, mid) = self.compose_cast(value, source, target)
+        if mid == Inconsistent():
+          return self.apply_cast(value, source, mid)
+        if source == target and mid == target:
+          return value
+        (read, write) = self.cast_closures(source, mid, target)
+        proxy = ProxiedList(value, read, write)
+        proxy.cast = (value, source, mid)
+        return proxy
       case (t1, t2) if t1 == t2:
         return value
       case (t1, t2):
@@ -1,6 +1,7 @@
 from ast import *
 from interp_Lfun import Function
 from interp_Llambda import InterpLlambda
+from interp_Lint import fallthrough
 from utils import *
 from dataclasses import dataclass
 
@@ -137,11 +138,11 @@ class InterpLdyn(InterpLlambda):
         
       # Lwhile statements
       case While(test, body, []):
-        v = self.interp_exp(test, env)
-        if self.untag(v, 'bool', test):
-            self.interp_stmts(body + [s] + cont, env)
-        else:
-          return self.interp_stmts(cont, env)
+        while self.untag(self.interp_exp(test, env), 'bool', test):
+          result = self.exec_stmts(body, env)
+          if result is not fallthrough:
+            return result
+        return self.interp_stmts(cont, env)
     
       # Ltup statements
       case Assign([Subscript(tup, index)], value):
@@ -158,7 +159,8 @@ class InterpLdyn(InterpLlambda):
             ps = [p.arg for p in params.args]
         else:
             ps = [x for (x,t) in params]
-        env[name] = self.tag(Function(name, ps, bod, env))
+        env[name] = self.tag(Function(name, ps, bod, env,
+                                      getattr(s, 'layout', None)))
         return self.interp_stmts(cont, env)
         
       case _:
@@ -4,26 +4,141 @@ from utils import *
 
 class Function:
     __match_args__ = ("name", "params", "body", "env")
-    def __init__(self, name, params, body, env):
+    def __init__(self, name, params, body, env, layout=None):
         self.name = name
         self.params = params
         self.body = body
         self.env = env
+        self.layout = layout
     def __repr__(self):
         return 'Function(' + self.name + ', ...)'
 
+# The value of a local variable that has not been assigned yet. Looking
+# it up continues with the enclosing environment, as it did when each
+# call copied the environment.
+unassigned = object()
+
+# The environment of a call: the values of the function's parameters
+# and local variables, at the positions given by its layout, and the
+# environment that the function was defined in, which is another
+# Frame or the dictionary of global variables. A Frame supports
+# env[x] and env[x] = v like the dictionary does.
+class Frame:
+    __slots__ = ('layout', 'values', 'parent')
+    def __init__(self, layout, values, parent):
+        self.layout = layout
+        self.values = values
+        self.parent = parent
+    def __getitem__(self, x):
+        env = self
+        while isinstance(env, Frame):
+            i = env.layout.get(x)
+            if i is not None and env.values[i] is not unassigned:
+                return env.values[i]
+            env = env.parent
+        return env[x]
+    def __setitem__(self, x, v):
+        self.values[self.layout[x]] = v
+    def __contains__(self, x):
+        try:
+            self[x]
+            return True
+        except KeyError:
+            return False
+    def __repr__(self):
+        return 'Frame(' + repr({x: self.values[i]
+                                for (x, i) in self.layout.items()}) + ', ...)'
+
+def child_nodes(node):
+    fields = node._fields or getattr(node, '__match_args__', ())
+    for field in fields:
+        value = getattr(node, field, None)
+        if isinstance(value, AST):
+            yield value
+        elif isinstance(value, list):
+            for v in value:
+                if isinstance(v, AST):
+                    yield v
+
+# Maps the parameters, then the variables that the body assigns to,
+# to their positions in a Frame. Nested functions and lambdas have
+# frames of their own.
+def frame_layout(params, body):
+    layout = {x: i for (i, x) in enumerate(params)}
+    def define(x):
+        if x not in layout:
+            layout[x] = len(layout)
+    def walk(node):
+        match node:
+            case Assign([Name(x)], _) | AnnAssign(Name(x), _, _, _):
+                define(x)
+            case FunctionDef(name, params, body, dl, returns, comment):
+                define(name)
+                return
+            case Lambda(_, _) | AnnLambda(_, _, _):
+                return
+        for child in child_nodes(node):
+            walk(child)
+    for s in body:
+        walk(s)
+    return layout
+
+# Lexical addressing: gives each function and lambda its frame layout
+# and each Name an address (depth, index, layout), meaning the variable
+# is at index in the frame depth levels up the chain, whose layout is
+# the given one. Names of global variables get None.
+def resolve_names(node, layouts):
+    match node:
+        case FunctionDef(name, params, body, dl, returns, comment):
+            node.layout = frame_layout(param_names(params), body)
+            for s in body:
+                resolve_names(s, [node.layout] + layouts)
+        case Lambda(params, body) | AnnLambda(params, _, body):
+            node.layout = frame_layout(param_names(params), [Return(body)])
+            resolve_names(body, [node.layout] + layouts)
+        case Name(id):
+            node.address = None
+            for (depth, layout) in enumerate(layouts):
+                if id in layout:
+                    node.address = (depth, layout[id], layout)
+                    break
+        case _:
+            for child in child_nodes(node):
+                resolve_names(child, layouts)
+
+# Looks up the Name e using its address, falling back to looking the
+# name up along the chain when the frames are not laid out the way
+# resolve_names expected.
+def lookup(e, env):
+    address = getattr(e, 'address', None)
+    if address is not None:
+        (depth, i, layout) = address
+        frame = env
+        while depth > 0 and isinstance(frame, Frame):
+            frame = frame.parent
+            depth -= 1
+        if isinstance(frame, Frame) and frame.layout is layout:
+            v = frame.values[i]
+            if v is not unassigned:
+                return v
+    return env[e.id]
+
 class InterpLfun(InterpLarray):
 
+  # A call allocates a Frame with a list of the arguments and room for
+  # the local variables, whose parent is the function's environment.
   def apply_fun(self, fun, args, e):
       match fun:
         case Function(name, xs, body, env):
-          new_env = {x: v for (x,v) in env.items()}
-          for (x,arg) in zip(xs, args):
-              new_env[x] = arg
-          return self.interp_stmts(body, new_env)
+          layout = fun.layout
+          if layout is None:
+              layout = fun.layout = frame_layout(param_names(xs), body)
+          values = list(args)
+          values.extend([unassigned] * (len(layout) - len(values)))
+          return self.interp_stmts(body, Frame(layout, values, env))
         case _:
           raise Exception('apply_fun: unexpected: ' + repr(fun))
-    
+
   def interp_exp(self, e, env):
     match e:
       case Call(Name(f), args) if f in builtin_functions:
@@ -32,6 +147,8 @@ class InterpLfun(InterpLarray):
         f = self.interp_exp(func, env)
         vs = [self.interp_exp(arg, env) for arg in args]
         return self.apply_fun(f, vs, e)
+      case Name(id):
+        return lookup(e, env)
       case FunRef(id, arity):
         return env[id]
       case _:
@@ -46,7 +163,7 @@ class InterpLfun(InterpLarray):
             ps = [p.arg for p in params.args]
         else:
             ps = [x for (x,t) in params]
-        env[name] = Function(name, ps, bod, env)
+        env[name] = Function(name, ps, bod, env, getattr(s, 'layout', None))
         return self.interp_stmts(cont, env)
       case _:
         return super().interp_stmt(s, env, cont)
@@ -54,6 +171,7 @@ class InterpLfun(InterpLarray):
   def interp(self, p):
     match p:
       case Module(ss):
+        resolve_names(p, [])
         env = {}
         self.interp_stmts(ss, env)
         if 'main' in env.keys():
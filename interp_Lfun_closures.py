@@ -0,0 +1,251 @@
+from ast import *
+from interp_Ltup import InterpLtup
+from utils import *
+
+# An interpreter for Lfun (and so for Lint through Larray) that first
+# translates the program into nested Python closures and then runs
+# them. The pattern matching and the dispatch through the super()
+# chain of the InterpL* classes happen once per AST node, during the
+# translation, instead of every time the node is evaluated.
+#
+# Variables are resolved to slots during the translation. The
+# variables of the top level live in a list of globals and those of a
+# function, its parameters and the variables it assigns to, live in a
+# list allocated per call. The result is the same as InterpLfun on
+# programs that do not read a variable before assigning it.
+
+# What a statement returns when control goes on to the next statement.
+proceed = object()
+
+class CompiledFunction:
+  __slots__ = ('name', 'num_params', 'num_slots', 'body')
+
+  def __init__(self, name, num_params, num_slots, body):
+    self.name = name
+    self.num_params = num_params
+    self.num_slots = num_slots
+    self.body = body
+
+  def __repr__(self):
+    return 'CompiledFunction(' + self.name + ', ...)'
+
+def assigned_vars(ss):
+  xs = []
+  for s in ss:
+    for node in walk(s):
+      match node:
+        case Assign([Name(x)], _) | AnnAssign(Name(x), _, _, _) \
+            if x not in xs:
+          xs.append(x)
+  return xs
+
+class ClosureInterpLfun:
+
+  # A scope maps each variable to ('local', index) or ('global', index).
+  def compile_var(self, x, scope):
+    if x not in scope:
+      raise Exception('compile_var: unbound variable ' + x)
+    match scope[x]:
+      case ('local', i):
+        return lambda frame: frame[i]
+      case ('global', i):
+        globals = self.globals
+        return lambda frame: globals[i]
+
+  def compile_exp(self, e, scope):
+    match e:
+      case Constant(value):
+        return lambda frame: value
+      case Name(x):
+        return self.compile_var(x, scope)
+      case BinOp(left, op, right):
+        l = self.compile_exp(left, scope)
+        r = self.compile_exp(right, scope)
+        match op:
+          case Add():
+            return lambda frame: add64(l(frame), r(frame))
+          case Sub():
+            return lambda frame: sub64(l(frame), r(frame))
+          case Mult():
+            return lambda frame: mul64(l(frame), r(frame))
+      case UnaryOp(USub(), v):
+        v = self.compile_exp(v, scope)
+        return lambda frame: neg64(v(frame))
+      case UnaryOp(Not(), v):
+        v = self.compile_exp(v, scope)
+        return lambda frame: not v(frame)
+      case BoolOp(And(), [left, right]):
+        l = self.compile_exp(left, scope)
+        r = self.compile_exp(right, scope)
+        return lambda frame: r(frame) if l(frame) else False
+      case BoolOp(Or(), [left, right]):
+        l = self.compile_exp(left, scope)
+        r = self.compile_exp(right, scope)
+        return lambda frame: True if l(frame) else r(frame)
+      case Compare(left, [cmp], [right]):
+        l = self.compile_exp(left, scope)
+        r = self.compile_exp(right, scope)
+        op = InterpLtup.compare_functions[type(cmp)]
+        return lambda frame: op(l(frame), r(frame))
+      case IfExp(test, body, orelse):
+        test = self.compile_exp(test, scope)
+        body = self.compile_exp(body, scope)
+        orelse = self.compile_exp(orelse, scope)
+        return lambda frame: body(frame) if test(frame) else orelse(frame)
+      case Tuple(es, Load()) | ast.List(es, Load()):
+        es = [self.compile_exp(e, scope) for e in es]
+        return lambda frame: [e(frame) for e in es]
+      case Subscript(tup, index, Load()) \
+          | Call(Name('array_load'), [tup, index]):
+        tup = self.compile_exp(tup, scope)
+        index = self.compile_exp(index, scope)
+        def load(frame):
+          t = tup(frame)
+          n = index(frame)
+          if n < len(t):
+            return t[n]
+          else:
+            raise TrappedError('array index out of bounds')
+        return load
+      case Call(Name('array_store'), [tup, index, value]):
+        store = self.compile_store(tup, index, value, scope)
+        def store_exp(frame):
+          store(frame)
+          return None
+        return store_exp
+      case Call(Name('input_int'), []):
+        return lambda frame: input_int()
+      case Call(Name('len' | 'array_len'), [tup]):
+        tup = self.compile_exp(tup, scope)
+        return lambda frame: len(tup(frame))
+      case Call(func, args):
+        func = self.compile_exp(func, scope)
+        args = [self.compile_exp(arg, scope) for arg in args]
+        def call(frame):
+          f = func(frame)
+          locals = [arg(frame) for arg in args]
+          locals.extend([None] * (f.num_slots - f.num_params))
+          result = f.body(locals)
+          return 0 if result is proceed else result
+        return call
+    raise Exception('compile_exp: unexpected ' + repr(e))
+
+  def compile_store(self, tup, index, value, scope):
+    tup = self.compile_exp(tup, scope)
+    index = self.compile_exp(index, scope)
+    value = self.compile_exp(value, scope)
+    def store(frame):
+      t = tup(frame)
+      n = index(frame)
+      if n < len(t):
+        t[n] = value(frame)
+      else:
+        raise TrappedError('array index out of bounds')
+      return proceed
+    return store
+
+  # A compiled statement returns proceed, or the value of a Return.
+  def compile_stmt(self, s, scope):
+    match s:
+      case Expr(Call(Name('print'), [arg])):
+        arg = self.compile_exp(arg, scope)
+        def print_stmt(frame):
+          print(arg(frame), end='')
+          return proceed
+        return print_stmt
+      case Expr(value):
+        value = self.compile_exp(value, scope)
+        def exp_stmt(frame):
+          value(frame)
+          return proceed
+        return exp_stmt
+      case AnnAssign(Name(x), _, None, _):
+        # a declaration without a value assigns nothing
+        return lambda frame: proceed
+      case Assign([Name(x)], value) | AnnAssign(Name(x), _, value, _):
+        value = self.compile_exp(value, scope)
+        match scope[x]:
+          case ('local', i):
+            def assign_local(frame):
+              frame[i] = value(frame)
+              return proceed
+            return assign_local
+          case ('global', i):
+            globals = self.globals
+            def assign_global(frame):
+              globals[i] = value(frame)
+              return proceed
+            return assign_global
+      case Assign([Subscript(tup, index)], value):
+        return self.compile_store(tup, index, value, scope)
+      case If(test, body, orelse):
+        test = self.compile_exp(test, scope)
+        body = self.compile_stmts(body, scope)
+        orelse = self.compile_stmts(orelse, scope)
+        return lambda frame: body(frame) if test(frame) else orelse(frame)
+      case While(test, body, []):
+        test = self.compile_exp(test, scope)
+        body = self.compile_stmts(body, scope)
+        def while_stmt(frame):
+          while test(frame):
+            result = body(frame)
+            if result is not proceed:
+              return result
+          return proceed
+        return while_stmt
+      case Return(None):
+        return lambda frame: None
+      case Return(value):
+        return self.compile_exp(value, scope)
+      case FunctionDef(name, params, body, dl, returns, comment):
+        f = self.compile_function(name, params, body, scope)
+        globals = self.globals
+        i = scope[name][1]
+        def define(frame):
+          globals[i] = f
+          return proceed
+        return define
+    raise Exception('compile_stmt: unexpected ' + repr(s))
+
+  def compile_stmts(self, ss, scope):
+    ss = [self.compile_stmt(s, scope) for s in ss]
+    def stmts(frame):
+      for s in ss:
+        result = s(frame)
+        if result is not proceed:
+          return result
+      return proceed
+    return stmts
+
+  def compile_function(self, name, params, body, global_scope):
+    ps = param_names(params)
+    xs = ps + [x for x in assigned_vars(body) if x not in ps]
+    scope = dict(global_scope)
+    for (i, x) in enumerate(xs):
+      scope[x] = ('local', i)
+    # filled in after the body, which may call the function recursively
+    f = CompiledFunction(name, len(ps), len(xs), None)
+    f.body = self.compile_stmts(body, scope)
+    return f
+
+  def compile(self, p):
+    match p:
+      case Module(ss):
+        xs = assigned_vars([s for s in ss if not isinstance(s, FunctionDef)])
+        xs += [s.name for s in ss if isinstance(s, FunctionDef)]
+        self.globals = [None] * len(xs)
+        scope = {x: ('global', i) for (i, x) in enumerate(xs)}
+        body = self.compile_stmts(ss, scope)
+        main = scope.get('main')
+        globals = self.globals
+        def program():
+          body(None)
+          if main is not None:
+            f = globals[main[1]]
+            f.body([None] * f.num_slots)
+        return program
+      case _:
+        raise Exception('compile: unexpected ' + repr(p))
+
+  def interp(self, p):
+    self.compile(p)()
@@ -11,17 +11,15 @@ class InterpLgeneric(InterpLlambda):
       case _:
         return super().interp_exp(e, env)
 
-  def interp_stmts(self, ss, env):
-    if len(ss) == 0:
-      return
-    match ss[0]:
+  def interp_stmt(self, s, env, cont):
+    match s:
       case ImportFrom():
-        return self.interp_stmts(ss[1:], env)
+        return self.interp_stmts(cont, env)
       case Assign([Name(id)], Call(Name('TypeVar'), args)):
-        return self.interp_stmts(ss[1:], env)
+        return self.interp_stmts(cont, env)
       case Pass():
-        return self.interp_stmts(ss[1:], env)
+        return self.interp_stmts(cont, env)
       case _:
-        return super().interp_stmts(ss, env)
+        return super().interp_stmt(s, env, cont)
         
     
@@ -1,23 +1,16 @@
 from ast import *
 from interp_Lvar import InterpLvar
 from utils import *
+import operator
 
 class InterpLif(InterpLvar):
+  unary_functions = {**InterpLvar.unary_functions, Not: operator.not_}
+  compare_functions = {Lt: operator.lt, LtE: operator.le,
+                       Gt: operator.gt, GtE: operator.ge,
+                       Eq: operator.eq, NotEq: operator.ne}
 
   def interp_cmp(self, cmp):
-    match cmp:
-      case Lt():
-        return lambda x, y: x < y
-      case LtE():
-        return lambda x, y: x <= y
-      case Gt():
-        return lambda x, y: x > y
-      case GtE():
-        return lambda x, y: x >= y
-      case Eq():
-        return lambda x, y: x == y
-      case NotEq():
-        return lambda x, y: x != y
+    return self.compare_functions[type(cmp)]
 
   def interp_exp(self, e, env):
     match e:
@@ -27,8 +20,6 @@ class InterpLif(InterpLvar):
             return self.interp_exp(body, env)
           case False:
             return self.interp_exp(orelse, env)
-      case UnaryOp(Not(), v):
-        return not self.interp_exp(v, env)
       case BoolOp(And(), values):
         left = values[0]; right = values[1]
         match self.interp_exp(left, env):
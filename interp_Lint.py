@@ -35,18 +35,49 @@ def interp(p):
         case _:
             raise Exception('error in interp, unexpected ' + repr(p))
 
+# The statements that remain to be executed: those of stmts from index
+# on, followed by the statements of next. Adding a list of statements
+# in front, as in body + cont, makes a new Cont without copying.
+class Cont:
+  __slots__ = ('stmts', 'index', 'next')
+
+  def __init__(self, stmts, index, next):
+    self.stmts = stmts
+    self.index = index
+    self.next = next
+
+  def __radd__(self, ss):
+    return Cont(ss, 0, self)
+
+  def __repr__(self):
+    return 'Cont(' + repr(self.stmts[self.index:]) + ', ...)'
+
+# The result of exec_stmts when control reaches the end of the
+# statements.
+fallthrough = object()
+
 # This version is for InterpLvar to inherit from 
 class InterpLint:
+  # The function for each operator, keyed by the operator's class, so
+  # that evaluating an operation looks up its function instead of
+  # matching on the operator. Subclasses add operators by extending
+  # these tables.
+  binary_functions = {Add: add64, Sub: sub64}
+  unary_functions = {USub: neg64}
+
   def interp_exp(self, e, env):
     match e:
-      case BinOp(left, Add(), right):
+      case BinOp(left, op, right):
+        f = self.binary_functions.get(type(op))
+        if f is None:
+          raise Exception('error in interp_exp, unexpected ' + repr(e))
         l = self.interp_exp(left, env); r = self.interp_exp(right, env)
-        return add64(l, r)
-      case BinOp(left, Sub(), right):
-        l = self.interp_exp(left, env); r = self.interp_exp(right, env)
-        return sub64(l, r)
-      case UnaryOp(USub(), v):
-        return neg64(self.interp_exp(v, env))
+        return f(l, r)
+      case UnaryOp(op, v):
+        f = self.unary_functions.get(type(op))
+        if f is None:
+          raise Exception('error in interp_exp, unexpected ' + repr(e))
+        return f(self.interp_exp(v, env))
       case Constant(value):
         return value
       case Call(Name('input_int'), []):
@@ -54,10 +85,12 @@ class InterpLint:
       case _:
         raise Exception('error in interp_exp, unexpected ' + repr(e))
 
-  # The cont parameter is a list of statements that are the
-  # continuaton of the current statement s.
+  # The cont parameter is the continuation of the current statement
+  # s, i.e., the statements that come after it.
   # We use this continuation-passing approach because
   # it enables the handling of Goto in interp_Cif.py.
+  # A statement ends by returning self.interp_stmts(cont, env), or
+  # self.interp_stmts(ss + cont, env) to run ss first.
   def interp_stmt(self, s, env, cont):
     match s:
       case Expr(Call(Name('print'), [arg])):
@@ -70,12 +103,32 @@ class InterpLint:
       case _:
         raise Exception('error in interp_stmt, unexpected ' + repr(s))
     
+  # Given a Cont, which happens when a statement hands back its
+  # continuation, returns it to the loop in exec_stmts that is running
+  # the statement. Given a list, runs the statements and returns the
+  # value of a statement that does not continue, such as Return, or 0
+  # at the end.
   def interp_stmts(self, ss, env):
-    match ss:
-      case []:
-        return 0
-      case [s, *ss]:
-        return self.interp_stmt(s, env, ss)
+    if isinstance(ss, Cont):
+      return ss
+    result = self.exec_stmts(ss, env)
+    return 0 if result is fallthrough else result
+
+  # Runs the statements in a loop, so that long programs do not use up
+  # the Python stack. Returns fallthrough if control reaches the end of
+  # ss, and otherwise the value of the statement that stopped.
+  def exec_stmts(self, ss, env):
+    k = Cont(ss, 0, None)
+    while k is not None:
+      if k.index == len(k.stmts):
+        k = k.next
+        continue
+      s = k.stmts[k.index]
+      result = self.interp_stmt(s, env, Cont(k.stmts, k.index + 1, k.next))
+      if not isinstance(result, Cont):
+        return result
+      k = result
+    return fallthrough
 
   def interp(self, p):
     match p:
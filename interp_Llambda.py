@@ -38,7 +38,8 @@ class InterpLlambda(InterpLfun):
       case FunRef(id, arity):
         return env[id]
       case Lambda(params, body):
-        return Function('lambda', params, [Return(body)], env)
+        return Function('lambda', params, [Return(body)], env,
+                        getattr(e, 'layout', None))
       case UncheckedCast(exp, ty):
         return self.interp_exp(exp, env)
       case Closure(arity, args):
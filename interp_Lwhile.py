@@ -1,5 +1,6 @@
 from ast import *
 from interp_Lif import InterpLif
+from interp_Lint import fallthrough
 from utils import *
 
 class InterpLwhile(InterpLif):
@@ -7,10 +8,11 @@ class InterpLwhile(InterpLif):
   def interp_stmt(self, s, env, cont):
     match s:
       case While(test, body, []):
-        if self.interp_exp(test, env):
-            self.interp_stmts(body + [s] + cont, env)
-        else:
-          return self.interp_stmts(cont, env)
+        while self.interp_exp(test, env):
+          result = self.exec_stmts(body, env)
+          if result is not fallthrough:
+            return result
+        return self.interp_stmts(cont, env)
       case _:
         return super().interp_stmt(s, env, cont)
     
@@ -6,11 +6,13 @@ from dataclasses import dataclass
 
 from utils import *
 
-from convert_x86 import convert_program
-from parser_x86 import x86_parser, x86_parser_instrs
-
+# convert_x86 and parser_x86 import lark, and the pretty printing of
+# the state imports pandas, so they are imported where they are first
+# needed: importing this module stays cheap for processes that never
+# emulate x86.
 
 def interp_x86(program):
+    from convert_x86 import convert_program
     x86_program = convert_program(program)
     emu = X86Emulator(logging=False)
     x86_output = emu.eval_program(x86_program)
@@ -37,7 +39,8 @@ class X86Emulator:
             print(s)
 
     def parse_and_eval_program(self, s):
-        p = x86_parser.parse(s)
+        from parser_x86 import x86_parser
+        p = x86_parser().parse(s)
 
     def eval_program(self, p):
         assert p.data == 'prog'
@@ -74,8 +77,9 @@ class X86Emulator:
 
     def eval_instructions(self, s):
         import pandas as pd
+        from parser_x86 import x86_parser_instrs
 
-        p = x86_parser_instrs.parse(s)
+        p = x86_parser_instrs().parse(s)
 
         assert p.data == 'instrs'
         blocks = {}
@@ -1,9 +1,15 @@
 # Author: Joe Near
 # License: GPLv3
 
+from functools import cache
 from lark import Lark
 
-x86_parser = Lark(r"""
+# The parsers are built on first use rather than at import time, and
+# with cache=True Lark saves the LALR tables to a file in the temporary
+# directory (keyed by the grammar, options, and Lark and Python
+# versions), so only the first process to parse x86 builds them.
+
+x86_grammar = r"""
     ?instr: "movq" arg "," arg -> movq
           | "addq" arg "," arg -> addq
           | "subq" arg "," arg -> subq
@@ -56,9 +62,9 @@ x86_parser = Lark(r"""
 
     %import common.WS
     %ignore WS
-    """, start='prog', parser='lalr')
+    """
 
-x86_parser_instrs = Lark(r"""
+x86_instrs_grammar = r"""
     ?instr: "movq" arg "," arg -> movq
           | "addq" arg "," arg -> addq
           | "subq" arg "," arg -> subq
@@ -107,5 +113,13 @@ x86_parser_instrs = Lark(r"""
 
     %import common.WS
     %ignore WS
-    """, start='instrs', parser='lalr')
+    """
+
+@cache
+def x86_parser() -> Lark:
+    return Lark(x86_grammar, start='prog', parser='lalr', cache=True)
+
+@cache
+def x86_parser_instrs() -> Lark:
+    return Lark(x86_instrs_grammar, start='instrs', parser='lalr', cache=True)
 
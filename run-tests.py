@@ -5,14 +5,22 @@ sys.path.append('../python-student-support-code')
 sys.path.append('../python-student-support-code/interp_x86')
 
 import compiler
+import compiler_register_allocator
 import interp_Lvar
 import type_check_Lvar
-from utils import run_tests, run_one_test, enable_tracing
+import type_check_Lfun
+from ast import Add, BinOp, Call, Constant, Name, Return
+from type_check_cache import TypeCheckCache
+from utils import run_tests, run_one_test, enable_tracing, parse
 from interp_x86.eval_x86 import interp_x86
 
 enable_tracing()
 
 compiler = compiler.Compiler()
+regalloc_compiler = compiler_register_allocator.Compiler()
+# force the linear scan allocator, the tests are below its threshold
+linear_scan_compiler = compiler_register_allocator.Compiler()
+linear_scan_compiler.linear_scan_threshold = 0
 
 typecheck_Lvar = type_check_Lvar.TypeCheckLvar().type_check
 
@@ -28,6 +36,37 @@ interp_dict = {
     'patch_instructions': interp_x86,
 }
 
+# The compilers here have no functions, so check separately that a
+# TypeCheckCache reuses the functions a pass leaves alone and checks
+# again the ones it changes.
+def test_type_check_cache():
+    program = parse('def f(x : int) -> int:\n'
+                    '  return x + 1\n'
+                    'def g(y : int) -> int:\n'
+                    '  return f(y) - 2\n'
+                    'print(g(input_int()))\n')
+    cache = TypeCheckCache()
+    type_check = type_check_Lfun.TypeCheckLfun().type_check
+    cache.type_check(type_check, program, 'source')
+    # a pass that changes nothing
+    cache.type_check(type_check, program, 'shrink')
+    # a pass that changes g in place
+    g = program.body[1]
+    g.body = [Return(BinOp(Call(Name('f'), [Name('y')]), Add(), Constant(2)))]
+    cache.type_check(type_check, program, 'uniquify')
+    # a pass that rebuilds f in place with new nodes of the same shape
+    f = program.body[0]
+    f.body = [Return(BinOp(Name('x'), Add(), Constant(1)))]
+    cache.type_check(type_check, program, 'reveal_functions')
+    # checked and reused functions per pass
+    counts = {p: (row[1], row[2]) for (p, row) in cache.passes.items()}
+    expected = {'source': (2, 0), 'shrink': (0, 2), 'uniquify': (1, 1),
+                'reveal_functions': (1, 1)}
+    if counts != expected:
+        print('type check cache: FAILED ' + repr(counts))
+        sys.exit(1)
+    print('type check cache: passed')
+
 if False:
     run_one_test(os.getcwd() + '/tests/var/zero.py',
                  'var',
@@ -36,7 +75,14 @@ if False:
                  typecheck_dict,
                  interp_dict)
 else:
+    test_type_check_cache()
     run_tests('var', compiler, 'var',
               typecheck_dict,
               interp_dict)
+    run_tests('var', regalloc_compiler, 'regalloc',
+              typecheck_dict,
+              interp_dict)
+    run_tests('var', linear_scan_compiler, 'linear_scan',
+              typecheck_dict,
+              interp_dict)
 
@@ -1,7 +1,12 @@
+// clock_gettime is POSIX, so ask for it when compiling with -std=c99
+#define _POSIX_C_SOURCE 199309L
 #include <inttypes.h>
 #include <stdlib.h>
 #include <stdio.h>
 #include <assert.h>
+#include <string.h>
+#include <time.h>
+#include <errno.h>
 #include "runtime.h"
 
 // To do: we need to account for the "any" type. -Jeremy
@@ -16,6 +21,179 @@ static int64_t* tospace_end;
 // checked in order to ensure that initialization has occurred.
 static int initialized = 0;
 
+/*
+  Generational mode, chosen by setting GC_GENERATIONAL=1 in the
+  environment. Fromspace becomes the nursery, where the program keeps
+  allocating with free_ptr as before. A minor collection promotes the
+  live objects of the nursery to the end of the old space and empties
+  the nursery. When the old space might not have room for that, a
+  major collection copies everything live into a new, larger old space.
+
+  Old objects that point into the nursery are roots of a minor
+  collection. Stores into the heap must go through write_barrier,
+  so the mode is only used by programs that set uses_write_barrier.
+  The barrier marks the card (CARD_BYTES of the old space) of the field
+  written. A minor collection scans the objects on marked cards;
+  card_first[c] is the object that covers the first word of card c.
+*/
+static int generational = 0;
+static int64_t* old_begin;
+static int64_t* old_free;
+static int64_t* old_end;
+
+#define CARD_SHIFT 9
+#define CARD_BYTES (1 << CARD_SHIFT)
+static unsigned char* cards;
+static int64_t** card_first;
+static unsigned long num_cards;
+
+// copy_vector copies only the objects in these spaces and leaves
+// pointers to anywhere else alone.
+static int64_t* condemned_begin[2];
+static int64_t* condemned_end[2];
+static int num_condemned;
+
+static void condemn(int64_t* begin1, int64_t* end1,
+                    int64_t* begin2, int64_t* end2) {
+  condemned_begin[0] = begin1;
+  condemned_end[0] = end1;
+  condemned_begin[1] = begin2;
+  condemned_end[1] = end2;
+  num_condemned = begin2 ? 2 : 1;
+}
+
+static inline int is_condemned(int64_t* p) {
+  for (int i = 0; i != num_condemned; ++i)
+    if (condemned_begin[i] <= p && p < condemned_end[i])
+      return 1;
+  return 0;
+}
+
+static void generational_collect(int64_t** rootstack_ptr,
+                                 uint64_t bytes_requested);
+static void reset_cards();
+
+/*
+  Tunables, read from the environment by initialize:
+    GC_HEAP_SIZE         the initial heap (or nursery) size in bytes,
+                         instead of the size the program asks for
+    GC_GROWTH_FACTOR     how much a full heap grows by, more than 1 and
+                         at most 1024 (default 2)
+    GC_SHRINK_OCCUPANCY  shrink the copying collector's heap by the
+                         growth factor when less than this fraction of
+                         it is live after a collection, at least 0 and
+                         less than 1 (default 0, never), but not below
+                         the initial size
+  A value that is not a number or is out of range is ignored, with a
+  warning on stderr. Setting GC_STATS=1 prints statistics to stderr
+  when the program exits.
+*/
+static double growth_factor = 2.0;
+static double shrink_occupancy = 0.0;
+static uint64_t initial_heap_bytes;
+
+#define GC_STATS_RESIZES 32
+
+static struct {
+  uint64_t collections;
+  uint64_t minor_collections;
+  uint64_t major_collections;
+  uint64_t bytes_copied;
+  uint64_t first_heap_bytes;
+  uint64_t peak_heap_bytes;
+  double total_seconds;
+  double max_pause_seconds;
+  // the heap size after each of the first GC_STATS_RESIZES resizes,
+  // and the collection it happened in
+  uint64_t resizes;
+  uint64_t resize_bytes[GC_STATS_RESIZES];
+  uint64_t resize_collection[GC_STATS_RESIZES];
+} gc_stats;
+
+static uint64_t heap_bytes() {
+  uint64_t bytes = (fromspace_end - fromspace_begin) * sizeof(int64_t);
+  if (generational)
+    bytes += (old_end - old_begin) * sizeof(int64_t);
+  return bytes;
+}
+
+static void record_heap_size() {
+  uint64_t bytes = heap_bytes();
+  if (bytes > gc_stats.peak_heap_bytes)
+    gc_stats.peak_heap_bytes = bytes;
+  if (gc_stats.resizes < GC_STATS_RESIZES) {
+    gc_stats.resize_bytes[gc_stats.resizes] = bytes;
+    gc_stats.resize_collection[gc_stats.resizes] = gc_stats.collections;
+  }
+  gc_stats.resizes++;
+}
+
+static void print_gc_stats() {
+  fprintf(stderr, "GC statistics (%s collector)\n",
+          generational ? "generational" : "copying");
+  fprintf(stderr, "  collections     %" PRIu64, gc_stats.collections);
+  if (generational)
+    fprintf(stderr, " (%" PRIu64 " minor, %" PRIu64 " major)",
+            gc_stats.minor_collections, gc_stats.major_collections);
+  fprintf(stderr, "\n  bytes copied    %" PRIu64 "\n", gc_stats.bytes_copied);
+  fprintf(stderr, "  heap bytes      %" PRIu64 " initially, %" PRIu64
+          " at exit, %" PRIu64 " at peak\n", gc_stats.first_heap_bytes,
+          heap_bytes(), gc_stats.peak_heap_bytes);
+  fprintf(stderr, "  heap resizes    %" PRIu64, gc_stats.resizes);
+  for (uint64_t i = 0; i != gc_stats.resizes && i != GC_STATS_RESIZES; ++i)
+    fprintf(stderr, "%s%" PRIu64 " at collection %" PRIu64,
+            i == 0 ? ": " : ", ", gc_stats.resize_bytes[i],
+            gc_stats.resize_collection[i]);
+  if (gc_stats.resizes > GC_STATS_RESIZES)
+    fprintf(stderr, ", ...");
+  fprintf(stderr, "\n  total GC time   %.3f ms\n",
+          1000 * gc_stats.total_seconds);
+  fprintf(stderr, "  longest pause   %.3f ms\n",
+          1000 * gc_stats.max_pause_seconds);
+}
+
+static const char* env_setting(const char* name) {
+  const char* value = getenv(name);
+  return value && *value ? value : NULL;
+}
+
+// Parse all of s as a number, returning 0 if it is not one.
+static int parse_bytes(const char* s, uint64_t* bytes) {
+  char* end;
+  while (*s == ' ' || *s == '\t')
+    ++s;
+  if (*s == '-')
+    return 0;
+  errno = 0;
+  *bytes = strtoull(s, &end, 10);
+  return end != s && *end == '\0' && errno == 0;
+}
+
+static int parse_double(const char* s, double* d) {
+  char* end;
+  errno = 0;
+  *d = strtod(s, &end);
+  return end != s && *end == '\0' && errno == 0;
+}
+
+static void ignore_setting(const char* name, const char* value) {
+  fprintf(stderr, "%s=%s is ignored because it is not a number in range\n",
+          name, value);
+}
+
+static double seconds() {
+  struct timespec t;
+  clock_gettime(CLOCK_MONOTONIC, &t);
+  return t.tv_sec + t.tv_nsec * 1e-9;
+}
+
+// The size of a heap that grows from the given size, in whole words.
+static uint64_t grow_bytes(uint64_t bytes) {
+  uint64_t grown = (uint64_t) (bytes * growth_factor);
+  grown -= grown % sizeof(int64_t);
+  return grown > bytes ? grown : bytes + sizeof(int64_t);
+}
+
 /*
   Tuple Tag (64 bits)
   #b|- 7 bit unused -|- 50 bit field [50, 0] -| 6 bits length -| 1 bit isNotForwarding Pointer
@@ -118,6 +296,31 @@ int64_t* to_ptr(int64_t* p) {
 // initialize the state of the collector so that allocations can occur
 void initialize(uint64_t rootstack_size, uint64_t heap_size)
 {
+  const char* setting;
+  uint64_t bytes;
+  double d;
+  if ((setting = env_setting("GC_HEAP_SIZE"))) {
+    if (parse_bytes(setting, &bytes) && bytes >= sizeof(int64_t))
+      heap_size = bytes - bytes % sizeof(int64_t);
+    else
+      ignore_setting("GC_HEAP_SIZE", setting);
+  }
+  if ((setting = env_setting("GC_GROWTH_FACTOR"))) {
+    if (parse_double(setting, &d) && d > 1 && d <= 1024)
+      growth_factor = d;
+    else
+      ignore_setting("GC_GROWTH_FACTOR", setting);
+  }
+  if ((setting = env_setting("GC_SHRINK_OCCUPANCY"))) {
+    if (parse_double(setting, &d) && d >= 0 && d < 1)
+      shrink_occupancy = d;
+    else
+      ignore_setting("GC_SHRINK_OCCUPANCY", setting);
+  }
+  if ((setting = env_setting("GC_STATS")) && strcmp(setting, "0") != 0)
+    atexit(print_gc_stats);
+  initial_heap_bytes = heap_size;
+
   // 1. Check to make sure that our assumptions about the world are correct.
   assert(sizeof(int64_t) == sizeof(int64_t*));
   assert((heap_size % sizeof(int64_t)) == 0);
@@ -129,7 +332,23 @@ void initialize(uint64_t rootstack_size, uint64_t heap_size)
     exit(EXIT_FAILURE);
   }
 
-  if (!(tospace_begin = malloc(heap_size))) {
+  const char* mode = env_setting("GC_GENERATIONAL");
+  generational = mode && strcmp(mode, "0") != 0;
+  if (generational && !uses_write_barrier) {
+    fprintf(stderr, "GC_GENERATIONAL is ignored because the program does "
+            "not use the write barrier\n");
+    generational = 0;
+  }
+  if (generational) {
+    // the old space starts out the size of the nursery
+    if (!(old_begin = malloc(heap_size))) {
+      printf("Failed to malloc %" PRIu64 " byte old space\n", heap_size);
+      exit(EXIT_FAILURE);
+    }
+    old_free = old_begin;
+    old_end = old_begin + (heap_size / sizeof(int64_t));
+    reset_cards();
+  } else if (!(tospace_begin = malloc(heap_size))) {
     printf("Failed to malloc %" PRIu64 " byte tospace\n", heap_size);
     exit(EXIT_FAILURE);
   }
@@ -150,6 +369,7 @@ void initialize(uint64_t rootstack_size, uint64_t heap_size)
 
   // Useful for debugging
   initialized = 1;
+  gc_stats.first_heap_bytes = gc_stats.peak_heap_bytes = heap_bytes();
 
 }
 
@@ -157,7 +377,18 @@ void validate_vector(int64_t** scan_addr) {
   int64_t* scan_ptr = *scan_addr;
   int64_t tag = *scan_ptr;
   if (is_vecof(tag)) {
-    exit(EXIT_FAILURE);
+    int len = get_vecof_length(tag);
+    int64_t* data = scan_ptr + 1;
+    *scan_addr = scan_ptr + len + 1;
+    if (get_vecof_ptr_bitfield(tag))
+      for (int i = 0; i != len; i++) {
+        int64_t* ptr = (int64_t*) data[i];
+        if (is_ptr(ptr)) {
+          int64_t* real_ptr = to_ptr(ptr);
+          assert(real_ptr < fromspace_end);
+          assert(real_ptr >= fromspace_begin);
+        }
+      }
   } else {
     unsigned char len = get_vector_length(tag);
     int64_t isPtrBits = get_vec_ptr_bitfield(tag);
@@ -176,7 +407,58 @@ void validate_vector(int64_t** scan_addr) {
   }
 }
 
+static void copying_collect(int64_t** rootstack_ptr,
+                            uint64_t bytes_requested);
+
 void collect(int64_t** rootstack_ptr, uint64_t bytes_requested)
+{
+  double start = seconds();
+  gc_stats.collections++;
+  if (generational)
+    generational_collect(rootstack_ptr, bytes_requested);
+  else
+    copying_collect(rootstack_ptr, bytes_requested);
+  double pause = seconds() - start;
+  gc_stats.total_seconds += pause;
+  if (pause > gc_stats.max_pause_seconds)
+    gc_stats.max_pause_seconds = pause;
+}
+
+// Replaces fromspace and tospace with spaces of new_bytes each,
+// copying the live data over.
+static void resize_heap(int64_t** rootstack_ptr, uint64_t new_bytes)
+{
+  // Free and allocate a new tospace of size new_bytes
+  free(tospace_begin);
+
+  if (!(tospace_begin = malloc(new_bytes))) {
+    printf("failed to malloc %" PRIu64 " byte fromspace", new_bytes);
+    exit(EXIT_FAILURE);
+  }
+
+  tospace_end = tospace_begin + new_bytes / (sizeof(int64_t));
+
+  // The pointers on the stack and in the heap must be updated,
+  // so this cannot be just a memcopy of the heap.
+  // Performing cheney's algorithm again will have the correct
+  // effect, and we have already implemented it.
+  cheney(rootstack_ptr);
+
+
+  // Cheney flips tospace and fromspace. Thus, we allocate another
+  // tospace not fromspace as we might expect.
+  free(tospace_begin);
+
+  if (!(tospace_begin = malloc(new_bytes))) {
+    printf("failed to malloc %" PRIu64 " byte tospace", new_bytes);
+    exit(EXIT_FAILURE);
+  }
+
+  tospace_end = tospace_begin + new_bytes / (sizeof(int64_t));
+  record_heap_size();
+}
+
+static void copying_collect(int64_t** rootstack_ptr, uint64_t bytes_requested)
 {
 #if 0
   printf("collecting, need %" PRIu64 "\n", bytes_requested);
@@ -237,37 +519,22 @@ void collect(int64_t** rootstack_ptr, uint64_t bytes_requested)
     new_bytes = needed_bytes;
 #else
     while (new_bytes <= needed_bytes) {
-      new_bytes = 2 * new_bytes;
+      new_bytes = grow_bytes(new_bytes);
     }
 #endif
 
-    // Free and allocate a new tospace of size new_bytes
-    free(tospace_begin);
-
-    if (!(tospace_begin = malloc(new_bytes))) {
-      printf("failed to malloc %lu byte fromspace", new_bytes);
-      exit(EXIT_FAILURE);
-    }
-
-    tospace_end = tospace_begin + new_bytes / (sizeof(int64_t));
-
-    // The pointers on the stack and in the heap must be updated,
-    // so this cannot be just a memcopy of the heap.
-    // Performing cheney's algorithm again will have the correct
-    // effect, and we have already implemented it.
-    cheney(rootstack_ptr);
-
-
-    // Cheney flips tospace and fromspace. Thus, we allocate another
-    // tospace not fromspace as we might expect.
-    free(tospace_begin);
-
-    if (!(tospace_begin = malloc(new_bytes))) {
-      printf("failed to malloc %lu byte tospace", new_bytes);
-      exit(EXIT_FAILURE);
-    }
-
-    tospace_end = tospace_begin + new_bytes / (sizeof(int64_t));
+    resize_heap(rootstack_ptr, new_bytes);
+  } else if (shrink_occupancy > 0) {
+    // Shrink the heap if little of it is live, as long as what is
+    // live and the bytes requested still fit.
+    uint64_t occupied_bytes = (free_ptr - fromspace_begin) * sizeof(int64_t);
+    uint64_t old_bytes = (fromspace_end - fromspace_begin) * sizeof(int64_t);
+    uint64_t new_bytes = (uint64_t) (old_bytes / growth_factor);
+    new_bytes -= new_bytes % sizeof(int64_t);
+    if (occupied_bytes < shrink_occupancy * old_bytes
+        && new_bytes >= initial_heap_bytes
+        && occupied_bytes + bytes_requested < new_bytes)
+      resize_heap(rootstack_ptr, new_bytes);
   }
 
   assert(free_ptr < fromspace_end);
@@ -403,6 +670,7 @@ void cheney(int64_t** rootstack_ptr)
   // printf("cheney: starting copy, rootstack=%p\n", rootstack_ptr);
   int64_t* scan_ptr = tospace_begin;
   free_ptr = tospace_begin;
+  condemn(fromspace_begin, fromspace_end, NULL, NULL);
 
   /* traverse the root set to create the initial queue */
   for (int64_t** root_loc = rootstack_begin;
@@ -535,6 +803,8 @@ void copy_vector(int64_t** vector_ptr_loc)
   if (! is_ptr(old_vector_ptr))
     return;
   old_vector_ptr = to_ptr(old_vector_ptr);
+  if (! is_condemned(old_vector_ptr))
+    return;
 #if 0
   printf("copy_vector %p\n", old_vector_ptr);
 #endif
@@ -583,6 +853,7 @@ void copy_vector(int64_t** vector_ptr_loc)
     }
     // the free ptr can be updated to point to the next free ptr.
     free_ptr = free_ptr + length + 1;
+    gc_stats.bytes_copied += (length + 1) * sizeof(int64_t);
     
     // We need to set the forwarding pointer in the old_vector
     old_vector_ptr[0] = (int64_t) new_vector_ptr;
@@ -595,82 +866,504 @@ void copy_vector(int64_t** vector_ptr_loc)
 }
 
 
+static int64_t* allocate_space(uint64_t bytes, const char* what) {
+  int64_t* space = malloc(bytes);
+  if (!space) {
+    printf("failed to malloc %" PRIu64 " byte %s\n", bytes, what);
+    exit(EXIT_FAILURE);
+  }
+  return space;
+}
+
+static inline unsigned long card_of(int64_t* p) {
+  return ((char*) p - (char*) old_begin) >> CARD_SHIFT;
+}
+
+static inline int64_t* card_start(unsigned long c) {
+  return (int64_t*) ((char*) old_begin + (c << CARD_SHIFT));
+}
+
+// Makes a clean card table for the current old space.
+static void reset_cards() {
+  free(cards);
+  free(card_first);
+  num_cards = card_of(old_end) + 1;
+  cards = calloc(num_cards, 1);
+  card_first = calloc(num_cards, sizeof(int64_t*));
+  if (!cards || !card_first) {
+    printf("failed to malloc a card table of %lu cards\n", num_cards);
+    exit(EXIT_FAILURE);
+  }
+}
+
+// Records the objects in [begin, end) of the old space in card_first.
+static void record_objects(int64_t* begin, int64_t* end) {
+  int64_t* p = begin;
+  while (p != end) {
+    int64_t* next = p + get_vec_length(p[0]) + 1;
+    for (unsigned long c = card_of(p); card_start(c) < next; ++c)
+      if (card_start(c) >= p)
+        card_first[c] = p;
+    p = next;
+  }
+}
+
+// Copies the nursery objects that the fields on marked cards point
+// to, and clears the marks.
+static void scan_cards() {
+  for (unsigned long c = 0; c != num_cards; ++c) {
+    if (cards[c]) {
+      cards[c] = 0;
+      int64_t* p = card_first[c];
+      int64_t* end = card_start(c + 1);
+      while (p < end && p < old_free)
+        process_vector(&p);
+    }
+  }
+}
+
+// Promotes the live objects of the nursery to the end of the old space.
+static void minor_collection(int64_t** rootstack_ptr) {
+  condemn(fromspace_begin, fromspace_end, NULL, NULL);
+  int64_t* scan_ptr = old_free;
+  free_ptr = old_free;
+  for (int64_t** root_loc = rootstack_begin;
+       root_loc != rootstack_ptr;
+       ++root_loc)
+    copy_vector(root_loc);
+  scan_cards();
+  while (scan_ptr != free_ptr)
+    process_vector(&scan_ptr);
+  record_objects(old_free, free_ptr);
+  old_free = free_ptr;
+  free_ptr = fromspace_begin;
+}
+
+// Copies everything live, in the old space and the nursery, into a
+// new old space with room for a nursery's worth of promotions.
+static void major_collection(int64_t** rootstack_ptr) {
+  uint64_t old_bytes = (old_end - old_begin) * sizeof(int64_t);
+  uint64_t old_used = old_free - old_begin;
+  uint64_t young_used = free_ptr - fromspace_begin;
+  uint64_t nursery_len = fromspace_end - fromspace_begin;
+  uint64_t needed_bytes =
+    sizeof(int64_t) * (old_used + young_used + nursery_len);
+  uint64_t new_bytes = old_bytes;
+  while (new_bytes < needed_bytes)
+    new_bytes = grow_bytes(new_bytes);
+
+  int64_t* new_begin = allocate_space(new_bytes, "old space");
+  condemn(old_begin, old_free, fromspace_begin, fromspace_end);
+  int64_t* scan_ptr = new_begin;
+  free_ptr = new_begin;
+  for (int64_t** root_loc = rootstack_begin;
+       root_loc != rootstack_ptr;
+       ++root_loc)
+    copy_vector(root_loc);
+  while (scan_ptr != free_ptr)
+    process_vector(&scan_ptr);
+
+  free(old_begin);
+  old_begin = new_begin;
+  old_free = free_ptr;
+  old_end = new_begin + new_bytes / sizeof(int64_t);
+  reset_cards();
+  record_objects(old_begin, old_free);
+  free_ptr = fromspace_begin;
+}
+
+static void generational_collect(int64_t** rootstack_ptr,
+                                 uint64_t bytes_requested) {
+  if (old_end - old_free < free_ptr - fromspace_begin) {
+    uint64_t old_bytes = heap_bytes();
+    major_collection(rootstack_ptr);
+    gc_stats.major_collections++;
+    if (heap_bytes() != old_bytes)
+      record_heap_size();
+  } else {
+    minor_collection(rootstack_ptr);
+    gc_stats.minor_collections++;
+  }
+
+  // the nursery is empty now, so it can be replaced by a bigger one
+  uint64_t nursery_bytes = (fromspace_end - fromspace_begin) * sizeof(int64_t);
+  if (nursery_bytes <= bytes_requested) {
+    while (nursery_bytes <= bytes_requested)
+      nursery_bytes = grow_bytes(nursery_bytes);
+    free(fromspace_begin);
+    fromspace_begin = allocate_space(nursery_bytes, "nursery");
+    fromspace_end = fromspace_begin + nursery_bytes / sizeof(int64_t);
+    free_ptr = fromspace_begin;
+    record_heap_size();
+  }
+}
+
+void write_barrier(int64_t* field, int64_t value) {
+  if (generational && old_begin <= field && field < old_free
+      && is_ptr((int64_t*) value)) {
+    int64_t* p = to_ptr((int64_t*) value);
+    if (fromspace_begin <= p && p < fromspace_end)
+      cards[card_of(field)] = 1;
+  }
+}
+
+int64_t vector_set(int64_t* vec, int i, int64_t value) {
+  vec[i+1] = value;
+  write_barrier(&vec[i+1], value);
+  return 0;
+}
+
+
+/*
+  The programs observe their results through print_int, so these avoid
+  the cost of printf and scanf on every call. stdout is given a large
+  buffer that is flushed at exit (and that the other printers share, so
+  the order of the output is unchanged), and integers are formatted
+  and parsed by hand.
+*/
+
+#define STDOUT_BUFFER_SIZE (1 << 16)
+
+__attribute__((constructor))
+static void buffer_stdout() {
+  setvbuf(stdout, NULL, _IOFBF, STDOUT_BUFFER_SIZE);
+}
+
+// Writes the decimal digits of x just before end, and returns where
+// they start. There must be room for INT_DIGITS characters.
+#define INT_DIGITS 20
+
+static char* format_int(char* end, int64_t x) {
+  // negate as unsigned, so that INT64_MIN works too
+  uint64_t magnitude = x < 0 ? -(uint64_t) x : (uint64_t) x;
+  char* p = end;
+  do {
+    *--p = '0' + magnitude % 10;
+    magnitude /= 10;
+  } while (magnitude != 0);
+  if (x < 0)
+    *--p = '-';
+  return p;
+}
 
 // Read an integer from stdin
 int64_t read_int() {
-  int64_t i;
-  scanf("%" SCNd64, &i);
-  return i;
+  int c;
+  do {
+    c = getc(stdin);
+  } while (c == ' ' || c == '\n' || c == '\t' || c == '\r'
+           || c == '\v' || c == '\f');
+  int negative = 0;
+  if (c == '-' || c == '+') {
+    negative = c == '-';
+    c = getc(stdin);
+  }
+  if (!('0' <= c && c <= '9')) {
+    printf("read_int: expected an integer in the input\n");
+    exit(EXIT_FAILURE);
+  }
+  uint64_t magnitude = 0;
+  while ('0' <= c && c <= '9') {
+    magnitude = 10 * magnitude + (c - '0');
+    c = getc(stdin);
+  }
+  if (c != EOF)
+    ungetc(c, stdin);
+  return negative ? -magnitude : magnitude;
 }
 
 // print an integer to stdout
 void print_int(int64_t x) {
-  printf("%" PRId64, x);
+  char digits[INT_DIGITS];
+  char* end = digits + INT_DIGITS;
+  char* start = format_int(end, x);
+  fwrite(start, 1, end - start, stdout);
 }
 
 // print a bool to stdout
 void print_bool(int64_t x) {
   if (x){
-    printf("#t");
+    fputs("#t", stdout);
   } else {
-    printf("#f");
+    fputs("#f", stdout);
   }
 }
 
 void print_void() {
-  printf("#<void>");
+  fputs("#<void>", stdout);
 }
 
 void print_vecbegin() {
-  printf("#(");
+  fputs("#(", stdout);
 }
 
 void print_space() {
-  printf(" ");
+  fputs(" ", stdout);
 }
 
 void print_vecend() {
-  printf(")");
+  fputs(")", stdout);
 }
 
 void print_ellipsis() {
-  printf("#(...)");
+  fputs("#(...)", stdout);
 }
 
-/* to do: need to cycle detection. -Jeremy */
-void print_any(int64_t any) {
-  switch (any_tag(any)) {
-  case ANY_TAG_INT:
-    printf("%" PRId64, any >> ANY_TAG_LEN);
-    break;
-  case ANY_TAG_BOOL:
-    if (any >> ANY_TAG_LEN) {
-      printf("#t");
-    } else {
-      printf("#f");
+/*
+  print_any and print_vector walk the vectors with an explicit stack
+  instead of recursing, so deep structures do not overflow the C
+  stack. They write into a growable buffer and send it to stdout with
+  one fwrite at the end.
+
+  A vector that the walk reaches while it is still being printed is a
+  cycle, and prints as #(...), like print_ellipsis. The visited table
+  remembers where in the buffer each finished vector's text is, so a
+  vector shared by several parents is copied from there instead of
+  being walked again.
+*/
+
+struct print_buffer {
+  char* text;
+  size_t length;
+  size_t capacity;
+};
+
+// Makes room for n more characters in the buffer.
+static void buffer_reserve(struct print_buffer* b, size_t n) {
+  if (b->length + n > b->capacity) {
+    size_t capacity = b->capacity ? b->capacity : 256;
+    while (b->length + n > capacity)
+      capacity *= 2;
+    char* text = realloc(b->text, capacity);
+    if (!text) {
+      printf("failed to malloc %zu bytes for printing\n", capacity);
+      exit(EXIT_FAILURE);
     }
-    break;
-  case ANY_TAG_VEC: {
-    int64_t* vector_ptr = (int64_t*) (any & ~ANY_TAG_MASK);
-    int64_t tag = vector_ptr[0];
-    unsigned char len = get_vector_length(tag);
-    printf("#(");
-    for (int i = 0; i != len; ++i) {
-      print_any(vector_ptr[i + 1]); // this is wrong -Jeremy
+    b->text = text;
+    b->capacity = capacity;
+  }
+}
+
+static void buffer_write(struct print_buffer* b, const char* s, size_t n) {
+  buffer_reserve(b, n);
+  memcpy(b->text + b->length, s, n);
+  b->length += n;
+}
+
+// Appends a copy of n characters of the buffer, starting at start. It
+// takes an offset rather than a pointer because growing the buffer
+// may move it.
+static void buffer_copy_span(struct print_buffer* b, size_t start, size_t n) {
+  buffer_reserve(b, n);
+  memcpy(b->text + b->length, b->text + start, n);
+  b->length += n;
+}
+
+static void buffer_puts(struct print_buffer* b, const char* s) {
+  buffer_write(b, s, strlen(s));
+}
+
+static void buffer_int(struct print_buffer* b, int64_t x) {
+  char digits[INT_DIGITS];
+  char* end = digits + INT_DIGITS;
+  char* start = format_int(end, x);
+  buffer_write(b, start, end - start);
+}
+
+// Writes the buffer to stdout and frees it.
+static void buffer_flush(struct print_buffer* b) {
+  fwrite(b->text, 1, b->length, stdout);
+  free(b->text);
+  b->text = NULL;
+  b->length = b->capacity = 0;
+}
+
+// The visited table: an open addressing hash table from vectors to the
+// span of the buffer holding their text. A length of -1 means the
+// vector is still being printed.
+struct visited_entry {
+  int64_t* vector;
+  size_t start;
+  int64_t length;
+};
+
+struct visited_table {
+  struct visited_entry* entries;
+  size_t capacity;
+  size_t count;
+};
+
+static struct visited_entry* visited_find(struct visited_table* t,
+                                          int64_t* vector) {
+  size_t i = ((uintptr_t) vector >> 3) & (t->capacity - 1);
+  while (t->entries[i].vector && t->entries[i].vector != vector)
+    i = (i + 1) & (t->capacity - 1);
+  return &t->entries[i];
+}
+
+static struct visited_entry* visited_add(struct visited_table* t,
+                                         int64_t* vector, size_t start) {
+  if (2 * (t->count + 1) > t->capacity) {
+    struct visited_table bigger;
+    bigger.capacity = t->capacity ? 2 * t->capacity : 64;
+    bigger.count = t->count;
+    bigger.entries = calloc(bigger.capacity, sizeof(struct visited_entry));
+    if (!bigger.entries) {
+      printf("failed to malloc a table of %zu vectors for printing\n",
+             bigger.capacity);
+      exit(EXIT_FAILURE);
     }
-    printf(")");
-    break;
+    for (size_t i = 0; i != t->capacity; ++i)
+      if (t->entries[i].vector)
+        *visited_find(&bigger, t->entries[i].vector) = t->entries[i];
+    free(t->entries);
+    *t = bigger;
   }
-  case ANY_TAG_FUN:
-    printf("#<procedure>");
-    break;
-  case ANY_TAG_VOID:
-    printf("#<void>");
-    break;
-  default:
-    printf("unrecognized!");
-    exit(-1);
+  struct visited_entry* e = visited_find(t, vector);
+  e->vector = vector;
+  e->start = start;
+  e->length = -1;
+  t->count++;
+  return e;
+}
+
+struct print_frame {
+  int64_t* vector;
+  int next;  // the index of the next element to print
+  size_t start;
+};
+
+// In heap mode the values are heap vectors as laid out by the
+// collector, printed with their addresses for debugging (print_vector);
+// otherwise they are values of type Any (print_any).
+static void print_tree(int64_t value, int heap_mode) {
+  struct print_buffer out = { NULL, 0, 0 };
+  struct visited_table visited = { NULL, 0, 0 };
+  struct print_frame* stack = NULL;
+  size_t depth = 0;
+  size_t stack_capacity = 0;
+  int64_t* child = NULL;
+
+  // the value itself, unless it is a vector
+  if (heap_mode) {
+    child = (int64_t*) value;
+  } else {
+    switch (any_tag(value)) {
+    case ANY_TAG_VEC:
+      child = (int64_t*) (value & ~ANY_TAG_MASK);
+      break;
+    case ANY_TAG_INT:
+      buffer_int(&out, value >> ANY_TAG_LEN);
+      break;
+    case ANY_TAG_BOOL:
+      buffer_puts(&out, (value >> ANY_TAG_LEN) ? "#t" : "#f");
+      break;
+    case ANY_TAG_FUN:
+      buffer_puts(&out, "#<procedure>");
+      break;
+    case ANY_TAG_VOID:
+      buffer_puts(&out, "#<void>");
+      break;
+    default:
+      buffer_puts(&out, "unrecognized!");
+      buffer_flush(&out);
+      exit(-1);
+    }
+  }
+
+  while (child || depth != 0) {
+    if (child) {
+      // start printing the child vector, unless it has been seen
+      struct visited_entry* seen = visited.capacity
+        ? visited_find(&visited, child) : NULL;
+      if (seen && seen->vector) {
+        if (seen->length < 0)
+          buffer_puts(&out, "#(...)");
+        else
+          buffer_copy_span(&out, seen->start, seen->length);
+      } else {
+        if (heap_mode && is_vecof(child[0])) {
+          buffer_flush(&out);
+          exit(EXIT_FAILURE);
+        }
+        if (depth == stack_capacity) {
+          stack_capacity = stack_capacity ? 2 * stack_capacity : 64;
+          stack = realloc(stack, stack_capacity * sizeof(struct print_frame));
+          if (!stack) {
+            printf("failed to malloc a stack of %zu for printing\n",
+                   stack_capacity);
+            exit(EXIT_FAILURE);
+          }
+        }
+        stack[depth].vector = child;
+        stack[depth].next = 0;
+        stack[depth].start = out.length;
+        depth++;
+        visited_add(&visited, child, out.length);
+        if (heap_mode) {
+          char address[32];
+          snprintf(address, sizeof(address), "%p=#(", (void*) child);
+          buffer_puts(&out, address);
+        } else {
+          buffer_puts(&out, "#(");
+        }
+      }
+      child = NULL;
+      continue;
+    }
+
+    // print the next element of the vector on top of the stack
+    struct print_frame* top = &stack[depth - 1];
+    int64_t tag = top->vector[0];
+    int len = get_vector_length(tag);
+    if (top->next == len) {
+      buffer_puts(&out, ")");
+      visited_find(&visited, top->vector)->length = out.length - top->start;
+      depth--;
+      continue;
+    }
+    int i = top->next++;
+    int64_t element = top->vector[i + 1];
+    if (heap_mode) {
+      if (i != 0)
+        buffer_puts(&out, ", ");
+      if (((get_vec_ptr_bitfield(tag) >> i) & 1) == 1
+          && is_ptr((int64_t*) element))
+        child = to_ptr((int64_t*) element);
+      else
+        buffer_int(&out, element);
+    } else {
+      switch (any_tag(element)) {
+      case ANY_TAG_VEC:
+        child = (int64_t*) (element & ~ANY_TAG_MASK);
+        break;
+      case ANY_TAG_INT:
+        buffer_int(&out, element >> ANY_TAG_LEN);
+        break;
+      case ANY_TAG_BOOL:
+        buffer_puts(&out, (element >> ANY_TAG_LEN) ? "#t" : "#f");
+        break;
+      case ANY_TAG_FUN:
+        buffer_puts(&out, "#<procedure>");
+        break;
+      case ANY_TAG_VOID:
+        buffer_puts(&out, "#<void>");
+        break;
+      default:
+        buffer_puts(&out, "unrecognized!");
+        buffer_flush(&out);
+        exit(-1);
+      }
+    }
   }
+
+  buffer_flush(&out);
+  free(visited.entries);
+  free(stack);
+}
+
+void print_any(int64_t any) {
+  print_tree(any, 0);
 }
 
 void print_heap(int64_t** rootstack_ptr)
@@ -691,31 +1384,7 @@ void print_heap(int64_t** rootstack_ptr)
 
 void print_vector(int64_t* vector_ptr)
 {
-  int64_t tag = vector_ptr[0];
-  if (is_vecof(tag)) {
-    exit(EXIT_FAILURE);
-  } else {
-    unsigned char len = get_vector_length(tag);
-    int64_t* scan_ptr = vector_ptr;
-    int64_t* next_ptr = vector_ptr + len + 1;
-
-    printf("%p=#(", vector_ptr);
-    scan_ptr += 1;
-    int64_t isPointerBits = get_vec_ptr_bitfield(tag);
-    while (scan_ptr != next_ptr) {
-      if ((isPointerBits & 1) == 1 && is_ptr((int64_t*)*scan_ptr)) {
-        print_vector(to_ptr((int64_t*)*scan_ptr));
-      } else {
-        printf("%lld", (int64_t)*scan_ptr);
-      }
-      isPointerBits = isPointerBits >> 1;
-      scan_ptr += 1;
-      if (scan_ptr != next_ptr) {
-        printf(", ");
-      }
-    }
-    printf(")");
-  }
+  print_tree((int64_t) vector_ptr, 1);
 }
 
 
@@ -734,36 +1403,84 @@ int is_vector_proxy(int64_t* vec) {
   return (1 & (tag >> TAG_ISPROXY_RSHIFT)) == 1;
 }
 
-int64_t proxy_vector_length(int64_t* vec) {
-  if (is_vector_proxy(vec)) {
-    int64_t vec2 = vec[1];
-    return proxy_vector_length((int64_t*) vec2);
-  } else {
-    return get_vector_length(vec[0]);
+/*
+  A proxy is [tag, vector, reads, writes], where the vector may itself
+  be a proxy. For a tuple, reads and writes are tuples with one closure
+  per element; for a vectorof they are single closures. Gradually typed
+  programs can stack up long chains of proxies, so the functions below
+  walk the chain in a loop instead of recursing once per proxy.
+
+  Reading has to apply the read closures from the innermost proxy out,
+  so proxy_ref first collects them, on the C stack for chains of up to
+  PROXY_CHAIN_INLINE proxies and in a malloc'd array beyond that.
+*/
+#define PROXY_CHAIN_INLINE 64
+
+static int64_t* proxy_base(int64_t* vec) {
+  while (is_vector_proxy(vec))
+    vec = (int64_t*) vec[1];
+  return vec;
+}
+
+static int64_t* proxy_closure(int64_t field, int i, int vecof) {
+  if (vecof)
+    return (int64_t*) field;
+  else
+    return (int64_t*) ((int64_t*) field)[i+1];
+}
+
+static int64_t proxy_ref(int64_t* vec, int i, int vecof) {
+  int64_t* inline_reads[PROXY_CHAIN_INLINE];
+  int64_t** reads = inline_reads;
+  int capacity = PROXY_CHAIN_INLINE;
+  int depth = 0;
+  while (is_vector_proxy(vec)) {
+    if (depth == capacity) {
+      int64_t** more = malloc(2 * capacity * sizeof(int64_t*));
+      if (!more) {
+        printf("Failed to malloc a chain of %d proxies\n", 2 * capacity);
+        exit(EXIT_FAILURE);
+      }
+      for (int j = 0; j != depth; ++j)
+        more[j] = reads[j];
+      if (reads != inline_reads)
+        free(reads);
+      reads = more;
+      capacity *= 2;
+    }
+    reads[depth++] = proxy_closure(vec[2], i, vecof);
+    vec = (int64_t*) vec[1];
   }
+  int64_t val = vec[i+1];
+  while (depth != 0)
+    val = apply_closure(reads[--depth], val);
+  if (reads != inline_reads)
+    free(reads);
+  return val;
 }
 
-int64_t proxy_vector_ref(int64_t* vec, int i) {
-  if (is_vector_proxy(vec)) {
-    int64_t vec2 = vec[1];
-    int64_t val = proxy_vector_ref((int64_t*) vec2, i);
-    int64_t* rd = (int64_t*) ((int64_t*) vec[2])[i+1];
-    return apply_closure(rd, val);
-  } else {
-    return vec[i+1];
+// Writing applies the write closures from the outermost proxy in, so
+// it needs no storage.
+static int64_t proxy_set(int64_t* vec, int i, int64_t arg, int vecof) {
+  while (is_vector_proxy(vec)) {
+    arg = apply_closure(proxy_closure(vec[3], i, vecof), arg);
+    vec = (int64_t*) vec[1];
   }
+  vec[i+1] = arg;
+  write_barrier(&vec[i+1], arg);
+  return 0;
+}
+
+int64_t proxy_vector_length(int64_t* vec) {
+  return get_vector_length(proxy_base(vec)[0]);
+}
+
+int64_t proxy_vector_ref(int64_t* vec, int i) {
+  return proxy_ref(vec, i, 0);
 }
 
 int64_t proxy_vector_set(int64_t* vec, int i, int64_t arg) {
-  if (is_vector_proxy(vec)) {
-    int64_t vec2 = vec[1];
-    int64_t* wr = (int64_t*) ((int64_t*) vec[3])[i+1];
-    int64_t arg2 = apply_closure(wr, arg);
-    return proxy_vector_set((int64_t*) vec2, i, arg2);
-  } else {
-    vec[i+1] = arg;
-    return 0;
-  }
+  return proxy_set(vec, i, arg, 0);
 }
 
 
@@ -772,35 +1489,15 @@ int64_t proxy_vecof_set(int64_t* vec, int i, int64_t arg);
 int64_t proxy_vecof_length(int64_t* vec);
 
 int64_t proxy_vecof_length(int64_t* vec) {
-  if (is_vector_proxy(vec)) {
-    int64_t vec2 = vec[1];
-    return proxy_vecof_length((int64_t*) vec2);
-  } else {
-    return get_vecof_length(vec[0]);
-  }
+  return get_vecof_length(proxy_base(vec)[0]);
 }
 
 int64_t proxy_vecof_ref(int64_t* vec, int i) {
-  if (is_vector_proxy(vec)) {
-    int64_t vec2 = vec[1];
-    int64_t val = proxy_vecof_ref((int64_t*) vec2, i);
-    int64_t* rd = (int64_t*) vec[2];
-    return apply_closure(rd, val);
-  } else {
-    return vec[i+1];
-  }
+  return proxy_ref(vec, i, 1);
 }
 
 int64_t proxy_vecof_set(int64_t* vec, int i, int64_t arg) {
-  if (is_vector_proxy(vec)) {
-    int64_t vec2 = vec[1];
-    int64_t* wr = (int64_t*) vec[3];
-    int64_t arg2 = apply_closure(wr, arg);
-    return proxy_vecof_set((int64_t*) vec2, i, arg2);
-  } else {
-    vec[i+1] = arg;
-    return 0;
-  }
+  return proxy_set(vec, i, arg, 1);
 }
 
 int64_t proxy_vec_length(int64_t* vec) {
@@ -825,3 +1522,139 @@ int64_t proxy_vec_set(int64_t* vec, int i, int64_t arg) {
   }
     
 }
+
+/*
+  Collapsing proxy chains. A compiled program can call collapse_proxy
+  on a proxy it has just allocated. If the proxy wraps another proxy,
+  collapse_proxy points it at the underlying vector instead and gives
+  it composite closures that apply the inner proxy's closures and then
+  its own (reads) or its own and then the inner ones (writes). Proxies
+  made this way are never more than one deep, so an access looks at
+  one proxy and makes no recursive calls, however many times the value
+  has been cast.
+
+  A composite closure is [tag, compose_closures, leaves], where leaves
+  is a vectorof the closures to apply in order. Composing splices the
+  leaves of composites, so applying one is a single loop. The runtime
+  knows nothing of the types involved, so it cannot drop casts that
+  cancel out: each access still calls every closure. That, and copying
+  the leaves when composing, is proportional to the number of casts.
+*/
+
+static int64_t compose_closures(int64_t* clos, int64_t arg) {
+  int64_t* leaves = (int64_t*) clos[2];
+  int n = get_vecof_length(leaves[0]);
+  for (int j = 0; j != n; ++j)
+    arg = apply_closure((int64_t*) leaves[j+1], arg);
+  return arg;
+}
+
+static int is_composite(int64_t* clos) {
+  return clos[1] == (int64_t) compose_closures;
+}
+
+static int64_t leaf_count(int64_t* clos) {
+  if (is_composite(clos))
+    return get_vecof_length(((int64_t*) clos[2])[0]);
+  else
+    return 1;
+}
+
+static int64_t* copy_leaves(int64_t* dest, int64_t* clos) {
+  if (is_composite(clos)) {
+    int64_t* leaves = (int64_t*) clos[2];
+    int64_t n = get_vecof_length(leaves[0]);
+    memcpy(dest, leaves + 1, n * sizeof(int64_t));
+    return dest + n;
+  } else {
+    *dest = (int64_t) clos;
+    return dest + 1;
+  }
+}
+
+// The words composite(first, second) allocates.
+static int64_t composite_words(int64_t* first, int64_t* second) {
+  return 3 + 1 + leaf_count(first) + leaf_count(second);
+}
+
+// Allocates a closure that applies first and then second. The caller
+// has made room for composite_words(first, second).
+static int64_t* composite(int64_t* first, int64_t* second) {
+  int64_t n = leaf_count(first) + leaf_count(second);
+  int64_t* leaves = free_ptr;
+  free_ptr += 1 + n;
+  leaves[0] = ((int64_t) 1 << TAG_VECOF_RSHIFT)
+    | (n << TAG_VECOF_LENGTH_RSHIFT)
+    | (1 << TAG_VECOF_PTR_BITFIELD_RSHIFT) | 1;
+  copy_leaves(copy_leaves(leaves + 1, first), second);
+  int64_t* clos = free_ptr;
+  free_ptr += 3;
+  // two fields, of which the second (the leaves) is a pointer
+  clos[0] = (2 << TAG_VEC_PTR_BITFIELD_RSHIFT) | (2 << TAG_VEC_LENGTH_RSHIFT) | 1;
+  clos[1] = (int64_t) compose_closures;
+  clos[2] = (int64_t) leaves;
+  return clos;
+}
+
+// The number of words collapsing the proxy onto its inner proxy
+// allocates.
+static int64_t collapse_words(int64_t* proxy) {
+  int64_t* inner = (int64_t*) proxy[1];
+  if (is_vecof(proxy[0]))
+    return composite_words((int64_t*) inner[2], (int64_t*) proxy[2])
+      + composite_words((int64_t*) proxy[3], (int64_t*) inner[3]);
+  int n = get_vector_length(((int64_t*) proxy[2])[0]);
+  int64_t words = 2 * (1 + n);
+  for (int i = 0; i != n; ++i)
+    words += composite_words(proxy_closure(inner[2], i, 0),
+                             proxy_closure(proxy[2], i, 0))
+      + composite_words(proxy_closure(proxy[3], i, 0),
+                        proxy_closure(inner[3], i, 0));
+  return words;
+}
+
+// Stores into the proxy go through the barrier, because a collection
+// in collapse_proxy may have promoted it.
+static void set_proxy_field(int64_t* proxy, int i, int64_t* value) {
+  proxy[i] = (int64_t) value;
+  write_barrier(&proxy[i], (int64_t) value);
+}
+
+// Makes a proxy of a proxy wrap the underlying vector directly and
+// returns it. It may collect, so it returns the proxy's new address;
+// it uses the root stack slot at rootstack_ptr to keep the proxy live.
+int64_t* collapse_proxy(int64_t* proxy, int64_t** rootstack_ptr) {
+  while (is_vector_proxy((int64_t*) proxy[1])) {
+    int64_t words = collapse_words(proxy);
+    if (free_ptr + words > fromspace_end) {
+      rootstack_ptr[0] = proxy;
+      collect(rootstack_ptr + 1, words * sizeof(int64_t));
+      proxy = rootstack_ptr[0];
+    }
+    int64_t* inner = (int64_t*) proxy[1];
+    int64_t* reads;
+    int64_t* writes;
+    if (is_vecof(proxy[0])) {
+      reads = composite((int64_t*) inner[2], (int64_t*) proxy[2]);
+      writes = composite((int64_t*) proxy[3], (int64_t*) inner[3]);
+    } else {
+      int64_t tag = ((int64_t*) proxy[2])[0];
+      int n = get_vector_length(tag);
+      reads = free_ptr;
+      free_ptr += 1 + n;
+      writes = free_ptr;
+      free_ptr += 1 + n;
+      reads[0] = writes[0] = tag;
+      for (int i = 0; i != n; ++i) {
+        reads[i+1] = (int64_t) composite(proxy_closure(inner[2], i, 0),
+                                         proxy_closure(proxy[2], i, 0));
+        writes[i+1] = (int64_t) composite(proxy_closure(proxy[3], i, 0),
+                                          proxy_closure(inner[3], i, 0));
+      }
+    }
+    set_proxy_field(proxy, 1, (int64_t*) inner[1]);
+    set_proxy_field(proxy, 2, reads);
+    set_proxy_field(proxy, 3, writes);
+  }
+  return proxy;
+}
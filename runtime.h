@@ -21,7 +21,9 @@ int64_t** rootstack_begin;
 int64_t** rootstack_end;
 
 // Initialize the memory of the runtime with a fixed rootstack size
-// and initial heap size.
+// and initial heap size. The GC_* environment variables described in
+// runtime.c can override the heap size, tune how the heap grows and
+// shrinks, and turn on statistics.
 void initialize(uint64_t rootstack_size, uint64_t heap_size);
 
 // Collect garbage data making room for a requested amount of memory.
@@ -29,6 +31,30 @@ void initialize(uint64_t rootstack_size, uint64_t heap_size);
 // heap are still live.
 void collect(int64_t** rootstack_ptr, uint64_t bytes_requested);
 
+// Record a store of value into the field of a heap object. In the
+// generational mode (GC_GENERATIONAL=1) every store into the heap must
+// call this; otherwise it does nothing.
+void write_barrier(int64_t* field, int64_t value);
+
+// Store the value into element i of the vector and call write_barrier.
+// A compiler that supports the generational mode emits a call to this
+// for tuple and array stores instead of a movq.
+int64_t vector_set(int64_t* vec, int i, int64_t value);
+
+// A program sets this to 1 before calling initialize to say that all
+// of its stores into the heap go through write_barrier or vector_set.
+// Otherwise GC_GENERATIONAL is ignored, because a store the collector
+// does not see could leave an old object pointing to a young one that
+// a minor collection frees.
+int64_t uses_write_barrier;
+
+// Call on a newly allocated proxy to keep proxies from stacking up.
+// If the proxy wraps another proxy, it is changed to wrap the
+// underlying vector with the two proxies' closures composed. This may
+// collect, using the root stack slot at rootstack_ptr to hold the
+// proxy, so it returns the proxy's address after the collection.
+int64_t* collapse_proxy(int64_t* proxy, int64_t** rootstack_ptr);
+
 // Read an integer from stdin.
 int64_t read_int();
 
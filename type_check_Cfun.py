@@ -1,9 +1,10 @@
 from ast import *
 from utils import *
 from type_check_Carray import TypeCheckCarray
+from type_check_cache import CachedFunctionChecks
 import copy
 
-class TypeCheckCfun(TypeCheckCarray):
+class TypeCheckCfun(CachedFunctionChecks, TypeCheckCarray):
 
   def check_type_equal(self, t1, t2, e):
     if t1 == Bottom() or t2 == Bottom():
@@ -63,6 +64,9 @@ class TypeCheckCfun(TypeCheckCarray):
         super().type_check_tail(s, env)
 
   def type_check_def(self, d, env):
+    self.check_function(d, lambda: self.type_check_def_body(d, env))
+
+  def type_check_def_body(self, d, env):
     match d:
       case FunctionDef(name, params, blocks, dl, returns, comment):
         new_env = {x: t for (x,t) in env.items()}
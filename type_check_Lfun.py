@@ -1,10 +1,11 @@
 import ast
 from ast import *
 from type_check_Larray import TypeCheckLarray
+from type_check_cache import CachedFunctionChecks
 from utils import *
 import typing
 
-class TypeCheckLfun(TypeCheckLarray):
+class TypeCheckLfun(CachedFunctionChecks, TypeCheckLarray):
 
   def check_type_equal(self, t1, t2, e):
     if t1 == Bottom() or t2 == Bottom():
@@ -106,8 +107,10 @@ class TypeCheckLfun(TypeCheckLarray):
             raise Exception('type_check: duplicate parameter name in function ' + repr(name))
         for x,t in new_params:
             new_env[x] = t
-        rt = self.type_check_stmts(body, new_env)
-        self.check_type_equal(new_returns, rt, ss[0])
+        def check():
+          rt = self.type_check_stmts(body, new_env)
+          self.check_type_equal(new_returns, rt, ss[0])
+        self.check_function(ss[0], check)
         return self.type_check_stmts(ss[1:], env)
       case Return(value):
         return self.type_check_exp(value, env)
@@ -22,7 +22,31 @@ class TypeCheckLgrad(TypeCheckLlambda):
       raise Exception('error: ' + repr(t1) + ' inconsistent with ' + repr(t2) \
                       + ' in ' + repr(e))
 
+  # Types are interned, so these tables are keyed by identity. Keeping
+  # the types in the keys also keeps them alive, so a key is never
+  # confused with a later type that happens to get the same id. Each
+  # checker has its own tables, and they are emptied when they reach
+  # table_limit entries, so that they do not keep every type ever
+  # checked alive.
+  table_limit = 4096
+
+  def __init__(self):
+    self.consistent_table = {}
+    self.join_table = {}
+
+  def memoized(self, table, t1, t2, compute):
+      result = table.get((t1, t2))
+      if result is None:
+        if len(table) >= self.table_limit:
+          table.clear()
+        result = table[(t1, t2)] = compute(t1, t2)
+      return result
+
   def consistent(self, t1, t2):
+      return self.memoized(self.consistent_table, t1, t2,
+                           self.compute_consistent)
+
+  def compute_consistent(self, t1, t2):
       match (t1, t2):
         case (AnyType(), _):
           return True
@@ -39,6 +63,9 @@ class TypeCheckLgrad(TypeCheckLlambda):
           return t1 == t2
 
   def join_types(self, t1, t2):
+      return self.memoized(self.join_table, t1, t2, self.compute_join_types)
+
+  def compute_join_types(self, t1, t2):
       match (t1, t2):
         case (AnyType(), _):
           return t2
@@ -355,7 +382,8 @@ class TypeCheckLgrad(TypeCheckLlambda):
         new_env = {x: t for (x,t) in env.items()}
         for (x,t) in new_params:
             new_env[x] = t
-        self.type_check_stmts(body, new_env, new_returns)
+        self.check_function(s, lambda: self.type_check_stmts(body, new_env,
+                                                             new_returns))
       case Return(value):
         self.check_exp(value, return_type, env)
       # Cases in Llambda
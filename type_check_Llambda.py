@@ -113,7 +113,8 @@ class TypeCheckLlambda(TypeCheckLfun):
             new_returns = returns
         for (x,t) in new_params:
             new_env[x] = t
-        rt = self.check_stmts(body, new_returns, new_env)
+        self.check_function(ss[0],
+                            lambda: self.check_stmts(body, new_returns, new_env))
         self.check_stmts(ss[1:], return_ty, env)
       case Return(value):
         #trace('** tc_check return ' + repr(value))
@@ -0,0 +1,148 @@
+import ast
+import time
+from ast import *
+from utils import CProgramDefs
+
+# Remembers which functions have been type checked, so that checking
+# the program again after a pass only checks the functions that the
+# pass changed.
+#
+# After checking, the cache records a snapshot of each FunctionDef:
+# the nodes in it and, for each node, the values of its fields, with
+# child nodes compared by identity. When the program is checked again,
+# a FunctionDef is reused, keeping the has_type annotations from its
+# last check, if its snapshot is unchanged (so the pass neither
+# modified a node in place nor put in new nodes, which would lack the
+# annotations), the type checker is of the same class, and no
+# function's signature has changed.
+class TypeCheckCache:
+
+  def __init__(self):
+    # FunctionDef -> snapshot of it after its last check
+    self.snapshots = {}
+    self.signatures = None
+    self.checker_class = None
+    self.costs = {}
+    # pass name -> [seconds, functions checked, functions reused,
+    #               seconds saved, seconds spent taking snapshots]
+    self.passes = {}
+
+  # A field value with the nodes in it replaced by their ids. The ids
+  # stay unique because the snapshot keeps the nodes alive. Other
+  # values are paired with their type, so that e.g. 1 and True differ.
+  def field_value(self, v):
+    if isinstance(v, ast.AST):
+      return id(v)
+    elif isinstance(v, list):
+      return [self.field_value(x) for x in v]
+    else:
+      return (type(v), v)
+
+  def snapshot(self, d):
+    nodes = []
+    values = []
+    todo = [d]
+    while todo:
+      node = todo.pop()
+      nodes.append(node)
+      fs = node._fields or getattr(node, '__match_args__', ())
+      vs = [getattr(node, f, None) for f in fs]
+      values.append((type(node), [self.field_value(v) for v in vs]))
+      for v in vs:
+        if isinstance(v, ast.AST):
+          todo.append(v)
+        elif isinstance(v, list):
+          todo.extend(x for x in v if isinstance(x, ast.AST))
+    return (nodes, values)
+
+  def function_defs(self, program):
+    match program:
+      case Module(body):
+        return [s for s in body if isinstance(s, FunctionDef)]
+      case CProgramDefs(defs):
+        return [d for d in defs if isinstance(d, FunctionDef)]
+      case _:
+        return []
+
+  def type_check(self, type_check, program, passname):
+    # only a bound method of a checker that can skip functions can
+    # reuse them; anything else checks the whole program
+    checker = getattr(type_check, '__self__', None)
+    if not isinstance(checker, CachedFunctionChecks):
+      checker = None
+    defs = self.function_defs(program)
+    signatures = [(d.name, repr(d.args), repr(d.returns)) for d in defs]
+    start = time.perf_counter()
+    if checker is None or signatures != self.signatures \
+       or type(checker) is not self.checker_class:
+      reused = set()
+      current = {}
+    else:
+      current = {d: self.snapshot(d) for d in defs if d in self.snapshots}
+      reused = {d for d in current
+                if current[d][1] == self.snapshots[d][1]}
+    overhead = time.perf_counter() - start
+    start = time.perf_counter()
+    if checker is None:
+      type_check(program)
+    else:
+      checker.reused_functions = reused
+      checker.function_costs = self.costs
+      try:
+        type_check(program)
+      finally:
+        checker.reused_functions = frozenset()
+        checker.function_costs = None
+    elapsed = time.perf_counter() - start
+
+    # checking may have turned parameter annotations into types
+    self.signatures = [(d.name, repr(d.args), repr(d.returns)) for d in defs]
+    start = time.perf_counter()
+    if checker is None:
+      self.snapshots = {}
+    else:
+      # a reused function was not checked, so it is as it was
+      self.snapshots = {d: current[d] if d in reused else self.snapshot(d)
+                        for d in defs}
+    overhead += time.perf_counter() - start
+    self.checker_class = type(checker) if checker else None
+    self.costs = {d: c for (d, c) in self.costs.items()
+                  if d in self.snapshots}
+    row = self.passes.setdefault(passname, [0.0, 0, 0, 0.0, 0.0])
+    row[0] += elapsed + overhead
+    row[1] += len(defs) - len(reused)
+    row[2] += len(reused)
+    row[3] += sum(self.costs.get(d, 0.0) for d in reused)
+    row[4] += overhead
+
+  # saved is the time the reused functions took to check, less the
+  # time spent on snapshots, so it is negative when the cache does not
+  # pay for itself
+  def report(self) -> str:
+    lines = [f'{"pass":<26} {"seconds":>8} {"checked":>8} {"reused":>7}'
+             f' {"saved":>8}']
+    for (passname, (seconds, checked, reused, saved, overhead)) \
+        in self.passes.items():
+      lines.append(f'{passname:<26} {seconds:>8.4f} {checked:>8}'
+                   f' {reused:>7} {saved - overhead:>8.4f}')
+    return '\n'.join(lines)
+
+# Mixed into the type checkers for languages with functions. They check
+# each FunctionDef through check_function, which skips the ones a
+# TypeCheckCache found unchanged since they were last checked, so that
+# the annotations from that check are still in place, and records the
+# time it took to check each of the others.
+class CachedFunctionChecks:
+
+  reused_functions = frozenset()
+  function_costs = None
+
+  def check_function(self, d, check):
+    if d in self.reused_functions:
+      return
+    if self.function_costs is None:
+      check()
+      return
+    start = time.perf_counter()
+    check()
+    self.function_costs[d] = time.perf_counter() - start
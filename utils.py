@@ -1,9 +1,14 @@
 import os
 import sys
+import time
+import contextlib
+import itertools
 from sys import platform
 import ast
 from ast import *
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
+import weakref
+import threading
 
 # move these to the compilers, use a method with overrides -Jeremy
 builtin_functions = \
@@ -526,11 +531,15 @@ def repr_Subscript(self):
 Subscript.__repr__ = repr_Subscript
 
 
-def str_FunctionDef(self):
+def str_params(self):
     if isinstance(self.args, ast.arguments):
-        params = ', '.join([a.arg + ' : ' + str(a.annotation) for a in self.args.args])
+        return ', '.join([a.arg + ' : ' + str(a.annotation) for a in self.args.args])
     else:
-        params = ', '.join([x + ' : ' + str(t) for (x, t) in self.args])
+        return ', '.join([x + ' : ' + str(t) for (x, t) in self.args])
+
+
+def str_FunctionDef(self):
+    params = str_params(self)
     indent()
     if isinstance(self.body, list):
         body = ''.join([str(s) for s in self.body])
@@ -608,15 +617,51 @@ Name.__hash__ = hash_Name
 # Generating unique names
 ################################################################################
 
-name_id = 0
+# next() on an itertools.count is atomic, so threads that share this
+# counter never get the same name.
+name_id = itertools.count()
 
 
 def generate_name(name='tmp'):
-    global name_id
     ls = name.split('.')
-    new_id = name_id
-    name_id += 1
-    return ls[0] + '.' + str(new_id)
+    return ls[0] + '.' + str(next(name_id))
+
+
+# Generates the fresh names of one compilation. Names are numbered per
+# function: inside `with supply.function(name)` the numbers come from
+# that function's own counter, which carries on where it left off the
+# next time the function is entered, so a later pass never reuses a
+# name that an earlier pass generated in the same function. The names
+# made in a function include its name, as in tmp.f.0, so they cannot
+# clash with those of other functions or with the names generated
+# outside of any function, which come from a counter for the whole
+# program and look like tmp.0. The names therefore depend only on the
+# program being compiled, not on what was compiled before it or in
+# other threads.
+class NameSupply:
+
+    def __init__(self):
+        self.counters = {None: itertools.count()}
+        self.current = None
+
+    def fresh(self, name='tmp') -> str:
+        ls = name.split('.')
+        n = str(next(self.counters[self.current]))
+        if self.current is None:
+            return ls[0] + '.' + n
+        else:
+            return ls[0] + '.' + self.current + '.' + n
+
+    @contextlib.contextmanager
+    def function(self, name: str):
+        if name not in self.counters:
+            self.counters[name] = itertools.count()
+        outer = self.current
+        self.current = name
+        try:
+            yield self
+        finally:
+            self.current = outer
 
 
 ################################################################################
@@ -626,6 +671,56 @@ def generate_name(name='tmp'):
 class Type:
     pass
 
+
+# Types are hash-consed: constructing a type that is structurally equal
+# to a live one returns that same object, so types compare and hash by
+# identity and can be used as dictionary keys. Types must therefore
+# not be mutated after construction, including the lists they hold.
+interned_types = weakref.WeakValueDictionary()
+# Held while looking up and inserting a type, so that two threads
+# constructing equal types get the same object.
+interned_types_lock = threading.RLock()
+
+
+def type_key(x):
+    if isinstance(x, list):
+        return tuple(type_key(y) for y in x)
+    else:
+        return x
+
+
+def interned(cls):
+    names = [f.name for f in fields(cls)]
+    init = cls.__init__
+
+    def __new__(c, *args, **kwargs):
+        values = list(args) + [kwargs[n] for n in names[len(args):]]
+        key = (c,) + tuple(type_key(v) for v in values)
+        t = interned_types.get(key)
+        if t is None:
+            with interned_types_lock:
+                t = interned_types.get(key)
+                if t is None:
+                    t = object.__new__(c)
+                    init(t, *args, **kwargs)
+                    interned_types[key] = t
+        return t
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    cls.__new__ = __new__
+    cls.__init__ = __init__
+    cls.__eq__ = object.__eq__
+    cls.__hash__ = object.__hash__
+    cls.__copy__ = lambda self: self
+    cls.__deepcopy__ = lambda self, memo: self
+    # unpickling calls the class, so it gets the interned type too
+    cls.__reduce__ = lambda self: (cls, tuple(getattr(self, n)
+                                              for n in names))
+    return cls
+
+
 def make_assigns(bs):
     return [Assign([x], rhs) for (x, rhs) in bs]
 
@@ -785,30 +880,35 @@ class GlobalValue(expr):
         return str(self.name)
 
 
+@interned
 @dataclass(eq=True)
 class IntType(Type):
     def __str__(self):
         return 'int'
 
 
+@interned
 @dataclass(eq=True)
 class BoolType(Type):
     def __str__(self):
         return 'bool'
 
 
+@interned
 @dataclass(eq=True)
 class VoidType(Type):
     def __str__(self):
         return 'void'
 
 
+@interned
 @dataclass(eq=True)
 class Bottom(Type):
     def __str__(self):
         return 'bottom'
 
 
+@interned
 @dataclass(eq=True)
 class TupleType(Type):
     types: list[Type]
@@ -818,6 +918,7 @@ class TupleType(Type):
         return 'tuple[' + ','.join([str(p) for p in self.types]) + ']'
 
 
+@interned
 @dataclass(eq=True)
 class ListType(Type):
     elt_type: Type
@@ -827,6 +928,7 @@ class ListType(Type):
         return 'list[' + str(self.elt_type) + ']'
 
 
+@interned
 @dataclass(eq=True)
 class FunctionType:
     param_types: list[Type]
@@ -837,6 +939,7 @@ class FunctionType:
         return 'Callable[[' + ','.join([str(p) for p in self.param_types]) + ']' \
                + ', ' + str(self.ret_type) + ']'
 
+@interned
 @dataclass(eq=True)
 class GenericVar:
     id: str
@@ -844,6 +947,7 @@ class GenericVar:
     def __str__(self):
         return str(self.id)
     
+@interned
 @dataclass(eq=True)
 class AllType:
     params: list[str]
@@ -928,12 +1032,14 @@ class ValueOf(expr):
         return 'valueof(' + str(self.value) + ', ' + str(self.typ) + ')'
 
 
+@interned
 @dataclass(eq=True)
 class AnyType(Type):
     def __str__(self):
         return 'Any'
 
 
+@interned
 @dataclass(eq=True)
 class ProxyOrTupleType(Type):
     elt_types: list[Type]
@@ -942,6 +1048,7 @@ class ProxyOrTupleType(Type):
         return 'POrTuple[' + ','.join([str(t) for t in self.elt_types]) + ']'
 
 
+@interned
 @dataclass(eq=True)
 class ProxyOrListType(Type):
     elt_type: Type
@@ -1105,6 +1212,14 @@ def unzip(ls):
         ys += [y]
     return (xs, ys)
 
+# The names of a function's parameters, whether they are still
+# ast.arguments or have been turned into (name, type) pairs.
+def param_names(params):
+    if isinstance(params, ast.arguments):
+        return [p.arg for p in params.args]
+    else:
+        return [p if isinstance(p, str) else p[0] for p in params]
+
 
 def align(n: int, alignment: int) -> int:
     if 0 == n % alignment:
@@ -1180,13 +1295,26 @@ def test_pass(passname, interp_dict, program_root, ast,
         return 0  # ??
 
 
+# Type checks the program after the given pass, with the help of the
+# TypeCheckCache if there is one.
+def type_check_pass(type_check, program, passname, type_cache):
+    if type_cache:
+        type_cache.type_check(type_check, program, passname)
+    else:
+        type_check(program)
+
+
+# If a CompileCache is given and already has the x86 for the program,
+# the passes are skipped and only the executable is tested, so it is
+# the only pass counted. If a
+# TypeCheckCache is given, functions that a pass did not change are
+# not type checked again.
 def compile_and_test(compiler, compiler_name,
                      type_check_dict, interp_dict,
-                     program_filename):
+                     program_filename, cache=None, type_cache=None):
     total_passes = 0
     successful_passes = 0
     successful_test = 0
-    from eval_x86 import interp_x86
 
     program_root = os.path.splitext(program_filename)[0]
     with open(program_filename) as source:
@@ -1196,9 +1324,26 @@ def compile_and_test(compiler, compiler_name,
     trace(program)
     trace('')
 
+    if cache:
+        key = cache.key(compiler, program)
+        entry = cache.get(key, needs_passes=True)
+        if entry is not None:
+            trace('\n# compile cache hit\n')
+            x86_filename = program_root + ".s"
+            with open(x86_filename, "w") as dest:
+                dest.write(entry['x86'])
+            successful_test = run_executable(compiler_name, program_root,
+                                             x86_filename)
+            return (successful_test, 1, successful_test)
+        start = time.perf_counter()
+
+    if hasattr(compiler, 'begin_program'):
+        compiler.begin_program()
+
     if 'source' in type_check_dict.keys():
         trace('\n# type checking source program\n')
-        type_check_dict['source'](program)
+        type_check_pass(type_check_dict['source'], program, 'source',
+                        type_cache)
 
     passname = 'shrink'
     if hasattr(compiler, passname):
@@ -1207,7 +1352,8 @@ def compile_and_test(compiler, compiler_name,
         trace(program)
         trace('')
         if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
+            type_check_pass(type_check_dict[passname], program, passname,
+                            type_cache)
         total_passes += 1
         successful_passes += \
             test_pass(passname, interp_dict, program_root, program,
@@ -1219,7 +1365,8 @@ def compile_and_test(compiler, compiler_name,
         program = compiler.uniquify(program)
         trace(program)
         if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
+            type_check_pass(type_check_dict[passname], program, passname,
+                            type_cache)
         total_passes += 1
         successful_passes += \
             test_pass(passname, interp_dict, program_root, program,
@@ -1231,7 +1378,8 @@ def compile_and_test(compiler, compiler_name,
         program = compiler.reveal_functions(program)
         trace(program)
         if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
+            type_check_pass(type_check_dict[passname], program, passname,
+                            type_cache)
         total_passes += 1
         successful_passes += \
             test_pass(passname, interp_dict, program_root, program,
@@ -1244,7 +1392,8 @@ def compile_and_test(compiler, compiler_name,
         trace(program)
         trace('')
         if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
+            type_check_pass(type_check_dict[passname], program, passname,
+                            type_cache)
         total_passes += 1
         successful_passes += \
             test_pass(passname, interp_dict, program_root, program,
@@ -1257,7 +1406,8 @@ def compile_and_test(compiler, compiler_name,
         trace(program)
         trace('')
         if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
+            type_check_pass(type_check_dict[passname], program, passname,
+                            type_cache)
         total_passes += 1
         successful_passes += \
             test_pass(passname, interp_dict, program_root, program,
@@ -1269,7 +1419,8 @@ def compile_and_test(compiler, compiler_name,
         program = compiler.cast_insert(program)
         trace(program)
         if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
+            type_check_pass(type_check_dict[passname], program, passname,
+                            type_cache)
         total_passes += 1
         successful_passes += \
             test_pass(passname, interp_dict, program_root, program,
@@ -1281,7 +1432,8 @@ def compile_and_test(compiler, compiler_name,
         program = compiler.lower_casts(program)
         trace(program)
         if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
+            type_check_pass(type_check_dict[passname], program, passname,
+                            type_cache)
         total_passes += 1
         successful_passes += \
             test_pass(passname, interp_dict, program_root, program,
@@ -1293,7 +1445,8 @@ def compile_and_test(compiler, compiler_name,
         program = compiler.differentiate_proxies(program)
         trace(program)
         if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
+            type_check_pass(type_check_dict[passname], program, passname,
+                            type_cache)
         total_passes += 1
         successful_passes += \
             test_pass(passname, interp_dict, program_root, program,
@@ -1305,7 +1458,8 @@ def compile_and_test(compiler, compiler_name,
         program = compiler.reveal_casts(program)
         trace(program)
         if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
+            type_check_pass(type_check_dict[passname], program, passname,
+                            type_cache)
         total_passes += 1
         successful_passes += \
             test_pass(passname, interp_dict, program_root, program,
@@ -1317,7 +1471,8 @@ def compile_and_test(compiler, compiler_name,
         program = compiler.convert_assignments(program)
         trace(program)
         if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
+            type_check_pass(type_check_dict[passname], program, passname,
+                            type_cache)
         total_passes += 1
         successful_passes += \
             test_pass(passname, interp_dict, program_root, program,
@@ -1329,7 +1484,8 @@ def compile_and_test(compiler, compiler_name,
         program = compiler.convert_to_closures(program)
         trace(program)
         if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
+            type_check_pass(type_check_dict[passname], program, passname,
+                            type_cache)
         total_passes += 1
         successful_passes += \
             test_pass(passname, interp_dict, program_root, program,
@@ -1342,7 +1498,8 @@ def compile_and_test(compiler, compiler_name,
         trace(program)
         if passname in type_check_dict.keys():
             trace('type checking after ' + passname + '\n')
-            type_check_dict[passname](program)
+            type_check_pass(type_check_dict[passname], program, passname,
+                            type_cache)
         total_passes += 1
         successful_passes += \
             test_pass(passname, interp_dict, program_root, program,
@@ -1355,7 +1512,8 @@ def compile_and_test(compiler, compiler_name,
         trace(program)
         if passname in type_check_dict.keys():
             trace('type checking after ' + passname + '\n')
-            type_check_dict[passname](program)
+            type_check_pass(type_check_dict[passname], program, passname,
+                            type_cache)
         total_passes += 1
         successful_passes += \
             test_pass(passname, interp_dict, program_root, program,
@@ -1367,7 +1525,8 @@ def compile_and_test(compiler, compiler_name,
         program = compiler.remove_complex_operands(program)
         trace(program)
         if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
+            type_check_pass(type_check_dict[passname], program, passname,
+                            type_cache)
         total_passes += 1
         successful_passes += \
             test_pass(passname, interp_dict, program_root, program,
@@ -1379,7 +1538,8 @@ def compile_and_test(compiler, compiler_name,
         program = compiler.explicate_control(program)
         trace(program)
         if passname in type_check_dict.keys():
-            type_check_dict[passname](program)
+            type_check_pass(type_check_dict[passname], program, passname,
+                            type_cache)
             trace('type checking passed')
         else:
             trace('skipped type checking')
@@ -1427,13 +1587,17 @@ def compile_and_test(compiler, compiler_name,
 
         x86_filename = program_root + ".s"
         with open(x86_filename, "w") as dest:
-            dest.write(str(program))
-
+            program.write_to(dest)
         total_passes += 1
+        if cache:
+            with open(x86_filename) as source:
+                cache.put(key, source.read(), time.perf_counter() - start,
+                          total_passes)
 
         # Run the final x86 program
         emulate_x86 = False
         if emulate_x86:
+            from eval_x86 import interp_x86
             stdin = sys.stdin
             stdout = sys.stdout
             sys.stdin = open(program_root + '.in', 'r')
@@ -1441,26 +1605,38 @@ def compile_and_test(compiler, compiler_name,
             interp_x86(program)
             sys.stdin = stdin
             sys.stdout = stdout
+            successful_test = check_output(compiler_name, program_root)
         else:
-            if platform == 'darwin':
-                os.system('gcc -arch x86_64 runtime.o ' + x86_filename)
-            else:
-                os.system('gcc runtime.o ' + x86_filename)
-            input_file = program_root + '.in'
-            output_file = program_root + '.out'
-            os.system('./a.out < ' + input_file + ' > ' + output_file)
-
-        result = os.system('diff' + ' -b ' + program_root + '.out ' \
-                           + program_root + '.golden')
-        if result == 0:
-            successful_passes += 1
-            successful_test = 1
-        else:
-            print('compiler ' + compiler_name + ', executable failed' \
-                  + ' on test ' + program_root)
+            successful_test = run_executable(compiler_name, program_root,
+                                             x86_filename)
+        successful_passes += successful_test
     return (successful_passes, total_passes, successful_test)
 
 
+# Assembles and links the x86 file with the runtime, runs it on the
+# test's input, and returns 1 if its output matches the golden file.
+def run_executable(compiler_name, program_root, x86_filename):
+    if platform == 'darwin':
+        os.system('gcc -arch x86_64 runtime.o ' + x86_filename)
+    else:
+        os.system('gcc runtime.o ' + x86_filename)
+    input_file = program_root + '.in'
+    output_file = program_root + '.out'
+    os.system('./a.out < ' + input_file + ' > ' + output_file)
+    return check_output(compiler_name, program_root)
+
+
+def check_output(compiler_name, program_root):
+    result = os.system('diff' + ' -b ' + program_root + '.out ' \
+                       + program_root + '.golden')
+    if result == 0:
+        return 1
+    else:
+        print('compiler ' + compiler_name + ', executable failed' \
+              + ' on test ' + program_root)
+        return 0
+
+
 def trace_ast_and_concrete(ast):
     trace("concrete syntax:")
     trace(ast)
@@ -1471,13 +1647,26 @@ def trace_ast_and_concrete(ast):
 
 # This function compiles the program without any testing
 def compile(compiler, compiler_name, type_check_L, type_check_C,
-            program_filename):
+            program_filename, cache=None, type_cache=None):
     program_root = os.path.splitext(program_filename)[0]
     with open(program_filename) as source:
         program = parse(source.read())
 
+    if cache:
+        key = cache.key(compiler, program)
+        entry = cache.get(key)
+        if entry is not None:
+            trace('\n# compile cache hit\n')
+            with open(program_root + ".s", "w") as dest:
+                dest.write(entry['x86'])
+            return
+        start = time.perf_counter()
+
+    if hasattr(compiler, 'begin_program'):
+        compiler.begin_program()
+
     trace('\n# type check\n')
-    type_check_L(program)
+    type_check_pass(type_check_L, program, 'source', type_cache)
     trace_ast_and_concrete(program)
 
     if hasattr(compiler, 'shrink'):
@@ -1492,31 +1681,36 @@ def compile(compiler, compiler_name, type_check_L, type_check_C,
 
     if hasattr(compiler, 'reveal_functions'):
         trace('\n# reveal functions\n')
-        type_check_L(program)
+        type_check_pass(type_check_L, program,
+                        'before reveal_functions', type_cache)
         program = compiler.reveal_functions(program)
         trace_ast_and_concrete(program)
 
     if hasattr(compiler, 'convert_assignments'):
         trace('\n# assignment conversion\n')
-        type_check_L(program)
+        type_check_pass(type_check_L, program,
+                        'before convert_assignments', type_cache)
         program = compiler.convert_assignments(program)
         trace_ast_and_concrete(program)
 
     if hasattr(compiler, 'limit_functions'):
         trace('\n# limit functions\n')
-        type_check_L(program)
+        type_check_pass(type_check_L, program,
+                        'before limit_functions', type_cache)
         program = compiler.limit_functions(program)
         trace_ast_and_concrete(program)
 
     if hasattr(compiler, 'convert_to_closures'):
         trace('\n# closure conversion\n')
-        type_check_L(program)
+        type_check_pass(type_check_L, program,
+                        'before convert_to_closures', type_cache)
         program = compiler.convert_to_closures(program)
         trace_ast_and_concrete(program)
 
     if hasattr(compiler, 'expose_allocation'):
         trace('\n# expose allocation\n')
-        type_check_L(program)
+        type_check_pass(type_check_L, program,
+                        'before expose_allocation', type_cache)
         program = compiler.expose_allocation(program)
         trace_ast_and_concrete(program)
 
@@ -1530,7 +1724,8 @@ def compile(compiler, compiler_name, type_check_L, type_check_C,
         trace_ast_and_concrete(program)
 
     if type_check_C:
-        type_check_C(program)
+        type_check_pass(type_check_C, program, 'explicate_control',
+                        type_cache)
 
     trace('\n# select instructions\n')
     pseudo_x86 = compiler.select_instructions(program)
@@ -1551,7 +1746,10 @@ def compile(compiler, compiler_name, type_check_L, type_check_C,
     # Output x86 program to the .s file
     x86_filename = program_root + ".s"
     with open(x86_filename, "w") as dest:
-        dest.write(str(x86))
+        x86.write_to(dest)
+    if cache:
+        with open(x86_filename) as source:
+            cache.put(key, source.read(), time.perf_counter() - start)
 
 # Given a test file name, the name of a language, a compiler, a type
 # checker and interpreter for the language, and an interpeter for the
@@ -1559,11 +1757,11 @@ def compile(compiler, compiler_name, type_check_L, type_check_C,
 # checking that the resulting programs produce output that matches the
 # golden file.
 def run_one_test(test, lang, compiler, compiler_name,
-                 type_check_dict, interp_dict):
+                 type_check_dict, interp_dict, cache=None, type_cache=None):
 #    test_root = os.path.splitext(test)[0]
 #    test_name = os.path.basename(test_root)
     return compile_and_test(compiler, compiler_name, type_check_dict,
-                            interp_dict, test)
+                            interp_dict, test, cache, type_cache)
 
 
 # Given the name of a language, a compiler, the compiler's name, a
@@ -1571,7 +1769,8 @@ def run_one_test(test, lang, compiler, compiler_name,
 # for the C intermediate language, test the compiler on all the tests
 # in the directory of for the given language, i.e., all the
 # python files in ./tests/<language>.
-def run_tests(lang, compiler, compiler_name, type_check_dict, interp_dict):
+def run_tests(lang, compiler, compiler_name, type_check_dict, interp_dict,
+              cache=None, type_cache=None):
     # Collect all the test programs for this language.
     homedir = os.getcwd()
     directory = homedir + '/tests/' + lang + '/'
@@ -1590,7 +1789,7 @@ def run_tests(lang, compiler, compiler_name, type_check_dict, interp_dict):
     for test in tests:
         (succ_passes, tot_passes, succ_test) = \
             run_one_test(test, lang, compiler, compiler_name,
-                         type_check_dict, interp_dict)
+                         type_check_dict, interp_dict, cache, type_cache)
         successful_passes += succ_passes
         total_passes += tot_passes
         successful_tests += succ_test
@@ -1601,3 +1800,7 @@ def run_tests(lang, compiler, compiler_name, type_check_dict, interp_dict):
           + ' for compiler ' + compiler_name + ' on language ' + lang)
     print('passes: ' + repr(successful_passes) + '/' + repr(total_passes) \
           + ' for compiler ' + compiler_name + ' on language ' + lang)
+    if cache:
+        print(cache.report())
+    if type_cache:
+        print(type_cache.report())
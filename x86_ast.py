@@ -1,44 +1,78 @@
 from __future__ import annotations
 
 import ast
+import io
 from dataclasses import dataclass
 from typing import Iterable
 
-from utils import dedent, indent, indent_stmt, label_name
+from utils import indent_stmt, label_name, str_params
 
+# The indentation of instructions in the assembly written by write_to.
+instr_indent = '    '
 
 @dataclass
 class X86Program:
     body: dict[str, list[instr]] | list[instr]
 
-    def __str__(self):
-        result = ''
+    # Writes the assembly to the stream one instruction at a time, so
+    # a large program is never held in memory as a single string.
+    def write_to(self, stream):
         if isinstance(self.body, dict):
             for (l,ss) in self.body.items():
                 if l == label_name('main'):
-                    result += '\t.globl ' + label_name('main') + '\n'
-                result += '\t.align 16\n'
-                result += l + ':\n'
-                indent()
-                result += ''.join([str(s) for s in ss]) + '\n'
-                dedent()
+                    stream.write('\t.globl ' + label_name('main') + '\n')
+                stream.write('\t.align 16\n')
+                stream.write(l + ':\n')
+                write_instrs(stream, ss, instr_indent)
+                stream.write('\n')
         else:
-            result += '\t.globl ' + label_name('main') + '\n' + \
-                      label_name('main') + ':\n'
-            indent()
-            result += ''.join([str(s) for s in self.body])
-            dedent()
-        result += '\n'
-        return result
+            stream.write('\t.globl ' + label_name('main') + '\n' + \
+                         label_name('main') + ':\n')
+            write_instrs(stream, self.body, instr_indent)
+        stream.write('\n')
+
+    def __str__(self):
+        result = io.StringIO()
+        self.write_to(result)
+        return result.getvalue()
 
 @dataclass
 class X86ProgramDefs:
     defs: list[ast.FunctionDef]
 
+    # Writes the functions in the same layout as str of a FunctionDef.
+    def write_to(self, stream):
+        for (i, d) in enumerate(self.defs):
+            if i != 0:
+                stream.write('\n')
+            stream.write('  def ' + d.name + '(' + str_params(d) + ')' + \
+                         ' -> ' + str(d.returns) + ':\n')
+            if isinstance(d.body, list):
+                write_instrs(stream, d.body, instr_indent)
+            elif isinstance(d.body, dict):
+                for (l, ss) in d.body.items():
+                    stream.write(l + ':\n')
+                    write_instrs(stream, ss, instr_indent + '  ')
+            stream.write('\n')
+
+    def __str__(self):
+        result = io.StringIO()
+        self.write_to(result)
+        return result.getvalue()
+
+# An instruction may also be a string, a line of assembly written as is.
+def write_instrs(stream, ss, indentation: str):
+    stream.writelines(s if isinstance(s, str)
+                      else indentation + s.assembly() + '\n'
+                      for s in ss)
+
+class instr:
+    # The instruction as a line of assembly, without indentation.
+    def assembly(self) -> str: ...
+
     def __str__(self):
-        return "\n".join([str(d) for d in self.defs])
+        return indent_stmt() + self.assembly() + '\n'
 
-class instr: ...
 class arg: ...
 class location(arg): ...
 
@@ -56,54 +90,56 @@ class Instr(instr):
         return self.args[0]
     def target(self):
         return self.args[-1]
-    def __str__(self):
-        return indent_stmt() + self.instr + ' ' + ', '.join(str(a) for a in self.args) + '\n'
+    def assembly(self):
+        if not self.args:
+            return self.instr
+        return self.instr + ' ' + ', '.join(str(a) for a in self.args)
 
 @dataclass(frozen=True, eq=False)
 class Callq(instr):
     func: str
     num_args: int
 
-    def __str__(self):
-        return indent_stmt() + 'callq' + ' ' + self.func + '\n'
+    def assembly(self):
+        return 'callq' + ' ' + self.func
 
 @dataclass(frozen=True, eq=False)
 class IndirectCallq(instr):
     func: arg
     num_args: int
 
-    def __str__(self):
-        return indent_stmt() + 'callq' + ' *' + str(self.func) + '\n'
+    def assembly(self):
+        return 'callq' + ' *' + str(self.func)
 
 @dataclass(frozen=True, eq=False)
 class JumpIf(instr):
     cc: str
     label: str
 
-    def __str__(self):
-        return indent_stmt() + 'j' + self.cc + ' ' + self.label + '\n'
+    def assembly(self):
+        return 'j' + self.cc + ' ' + self.label
 
 @dataclass(frozen=True, eq=False)
 class Jump(instr):
     label: str
 
-    def __str__(self):
-        return indent_stmt() + 'jmp ' + self.label + '\n'
+    def assembly(self):
+        return 'jmp ' + self.label
 
 @dataclass(frozen=True, eq=False)
 class IndirectJump(instr):
     target: location
 
-    def __str__(self):
-        return indent_stmt() + 'jmp *' + str(self.target) + '\n'
+    def assembly(self):
+        return 'jmp *' + str(self.target)
 
 @dataclass(frozen=True, eq=False)
 class TailJump(instr):
     func: arg
     arity: int
 
-    def __str__(self):
-        return indent_stmt() + 'tailjmp ' + str(self.func) + '\n'
+    def assembly(self):
+        return 'tailjmp ' + str(self.func)
 
 @dataclass(frozen=True)
 class Variable(location):